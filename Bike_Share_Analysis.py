@@ -13,9 +13,128 @@
  
 # import all necessary packages and functions.
 import csv # read and write csv files
+import sys
+import io # in-memory text buffers for condensed chunks
+import os
 from datetime import datetime # operations to parse dates
 from pprint import pprint # use to print data structures like dictionaries in
 import calendar
+from functools import lru_cache, wraps # memoize repeated timestamp prefixes
+from itertools import islice # read summary files in blocks
+from bisect import bisect_right # histogram bins
+import math
+import array # typed columns for the columnar summaries
+import json # columnar summary headers
+import struct # columnar summary headers
+import queue # decompressed blocks of compressed inputs
+import threading # background decompression
+
+# Compression modules by file suffix - raw and summary csv files ending in
+# one of these are decompressed or compressed on the fly
+COMPRESSED_SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma'}
+# Size of the blocks a compressed input is decompressed in, and how many
+# decompressed blocks the background thread may get ahead of the parser
+DECOMPRESS_BLOCK_SIZE = 1024 * 1024
+DECOMPRESS_QUEUE_BLOCKS = 8
+
+def is_compressed(filename):
+    """
+    Returns True if filename ends in one of COMPRESSED_SUFFIXES.
+    """
+    return os.path.splitext(filename)[1] in COMPRESSED_SUFFIXES
+
+def _compression_module(filename):
+    """
+    Imports and returns the compression module for the suffix of filename.
+    """
+    import importlib
+    return importlib.import_module(COMPRESSED_SUFFIXES[os.path.splitext(filename)[1]])
+
+class _PrefetchReader(io.RawIOBase):
+    """
+    Raw binary stream over a compressed file. A background thread
+    decompresses the file block by block into a bounded queue, so inflating
+    the next blocks overlaps with parsing the current one (zlib, bz2 and lzma
+    all release the GIL while they work). An error in the thread is raised
+    by the next read and by every read after it, so the stream never looks
+    like a clean end of file.
+    """
+
+    def __init__(self, filename):
+        # open here so a missing file fails straight away
+        self._source = _compression_module(filename).open(filename, 'rb')
+        self._blocks = queue.Queue(DECOMPRESS_QUEUE_BLOCKS)
+        self._stop = threading.Event()
+        self._block = memoryview(b'')
+        self._finished = False
+        self._error = None
+        self._thread = threading.Thread(target=self._decompress, daemon=True)
+        self._thread.start()
+
+    def _decompress(self):
+        try:
+            with self._source:
+                while True:
+                    block = self._source.read(DECOMPRESS_BLOCK_SIZE)
+                    if not self._put(block) or not block:
+                        return
+        except Exception as error:
+            self._put(error)
+
+    def _put(self, item):
+        """
+        Queues item, returning False instead if the reader was closed.
+        """
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._block:
+            if self._error is not None:
+                raise self._error
+            if self._finished:
+                return 0
+            item = self._blocks.get()
+            if isinstance(item, Exception):
+                self._error = item
+                raise item
+            if not item:
+                self._finished = True
+                return 0
+            self._block = memoryview(item)
+        n = min(len(buffer), len(self._block))
+        buffer[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+def open_trip_file(filename, mode='r', newline=None):
+    """
+    This function opens a raw or summary csv file as open(filename, mode,
+    newline=newline) would (mode 'r', 'rb', 'w' or 'a'), except that files
+    ending in .gz, .bz2 or .xz are decompressed or compressed on the fly.
+    Compressed inputs are read through a background decompression thread
+    (see _PrefetchReader).
+    """
+    if not is_compressed(filename):
+        return open(filename, mode, newline=newline)
+    if mode in ('r', 'rb'):
+        stream = io.BufferedReader(_PrefetchReader(filename), DECOMPRESS_BLOCK_SIZE)
+        return stream if mode == 'rb' else io.TextIOWrapper(stream, newline=newline)
+    return _compression_module(filename).open(filename, mode + 't', newline=newline)
 
 def print_first_point(filename):
     """
@@ -25,7 +144,7 @@ def print_first_point(filename):
     # print city name for reference
     city = filename.split('-')[0].split('/')[-1]
     print('\nCity: {}'.format(city))
-    with open(filename, 'r') as f_in:
+    with open_trip_file(filename) as f_in:
         # csv library to set up a DictReader object
         trip_reader = csv.DictReader(f_in)
         # DictReader object to read the first trip from the data file and store it in a variable
@@ -35,71 +154,135 @@ def print_first_point(filename):
     # output city name and first trip for later testing
     return (city, first_trip)
 
-# list of files for each city
-data_files = ['./data/NYC-CitiBike-2016.csv',
-              './data/Chicago-Divvy-2016.csv',
-              './data/Washington-CapitalBikeshare-2016.csv',]
+# Raw file layout of each city: the columns holding the trip duration, start
+# time and user type, the divisor taking the duration to minutes, the start
+# time format, the raw user types to rename to the standard ones and the
+# start and end station id columns (None if the city has none). More cities
+# are added with register_city_schema
+CITY_SCHEMAS = {'NYC': {'duration': 'tripduration',
+                        'duration_divisor': 60,
+                        'start_time': 'starttime',
+                        'start_time_format': '%m/%d/%Y %H:%M:%S',
+                        'user_type': 'usertype',
+                        'user_types': {},
+                        'start_station': 'start station id',
+                        'end_station': 'end station id'},
+                'Chicago': {'duration': 'tripduration',
+                            'duration_divisor': 60,
+                            'start_time': 'starttime',
+                            'start_time_format': '%m/%d/%Y %H:%M',
+                            'user_type': 'usertype',
+                            'user_types': {},
+                            'start_station': 'from_station_id',
+                            'end_station': 'to_station_id'},
+                'Washington': {'duration': 'Duration (ms)',
+                               'duration_divisor': 60000,
+                               'start_time': 'Start date',
+                               'start_time_format': '%m/%d/%Y %H:%M',
+                               'user_type': 'Member Type',
+                               'user_types': {'Registered': 'Subscriber',
+                                              'Casual': 'Customer'},
+                               'start_station': 'Start station number',
+                               'end_station': 'End station number'}}
 
-# print the first trip from each file, store in dictionary
-example_trips = {}
-for data_file in data_files:
-    city, first_trip = print_first_point(data_file)
-    example_trips[city] = first_trip
+def register_city_schema(city, duration, duration_divisor, start_time,
+                         start_time_format, user_type, user_types=None,
+                         start_station=None, end_station=None):
+    """
+    This function adds (or replaces) the raw file layout of a city in
+    CITY_SCHEMAS so its trips can be condensed. duration, start_time and
+    user_type are the column names of those fields, duration_divisor takes
+    the duration column to minutes and user_types maps raw user types to
+    'Subscriber' and 'Customer'. start_station and end_station name the
+    station id columns, needed only to condense with stations.
+    """
+    CITY_SCHEMAS[city] = {'duration': duration,
+                          'duration_divisor': duration_divisor,
+                          'start_time': start_time,
+                          'start_time_format': start_time_format,
+                          'user_type': user_type,
+                          'user_types': dict(user_types or {}),
+                          'start_station': start_station,
+                          'end_station': end_station}
 
 def duration_in_mins(datum, city):
     """
     Takes as input a dictionary containing info about a single trip (datum) and
     its origin city (city) and returns the trip duration in units of minutes.
     """
-    # Identify column name by city
-    column = ()
-    function = ()
-    if city == 'NYC':
-        column = 'tripduration'
-        function = 60
-    elif city == 'Chicago':
-        column = 'tripduration'
-        function = 60
-    elif city == 'Washington':
-        column = 'Duration (ms)'
-        function = 60000  
-    # Assign time to duration variable
-    duration = ()  
-    duration = (datum[column])  
+    # Look up column name and divisor in the city schema
+    schema = CITY_SCHEMAS[city]
     # Convert time to minutes and return
-    duration = int(duration) / function
-    return duration
+    return int(datum[schema['duration']]) / schema['duration_divisor']
 
-# A test to check that the code works. There should be no output if all of
-# the assertions pass. 
-tests = {'NYC': 13.9833,
-         'Chicago': 15.4333,
-         'Washington': 7.1231}
+# Number of distinct date/hour prefixes to remember - a full year is only
+# 366 * 24 = 8784 prefixes, so this comfortably holds a year of trips
+START_TIME_CACHE_SIZE = 16384
 
-for city in tests:
-    assert abs(duration_in_mins(example_trips[city], city) - tests[city]) < .001
+@lru_cache(maxsize=START_TIME_CACHE_SIZE)
+def _start_time_prefix(prefix):
+    """
+    Takes as input the date and hour part of a start time ('m/d/YYYY HH') and
+    returns the month, hour, and day of the week it refers to. Results are
+    memoized as the same prefix is shared by every trip started in that hour.
+    Raises ValueError for anything but ASCII digits of the lengths strptime
+    accepts (a four digit year, one or two digits otherwise).
+    """
+    date, hour = prefix.split(' ')
+    month, day, year = date.split('/')
+    if not (_is_digits(month, 2) and _is_digits(day, 2) and _is_digits(hour, 2)
+            and len(year) == 4 and _is_digits(year, 4)):
+        raise ValueError('unexpected start time {!r}'.format(prefix))
+    month = int(month)
+    hour = int(hour)
+    # date() validates the day of the month, as strptime would
+    day_of_week = datetime(int(year), month, int(day)).weekday()
+    if not 0 <= hour <= 23:
+        raise ValueError('hour out of range in start time {!r}'.format(prefix))
+    return (month, hour, calendar.day_name[day_of_week])
 
-def time_of_trip(datum, city):
+def parse_start_time(dateandtime, datetime_format):
     """
-    Takes as input a dictionary containing info about a single trip (datum) and
-    its origin city (city) and returns the month, hour, and day of the week in
-    which the trip was made.
+    Takes as input a raw start time string in one of the city formats
+    ('%m/%d/%Y %H:%M:%S' or '%m/%d/%Y %H:%M') and returns the month, hour, and
+    day of the week in which the trip was made. Other formats go straight to
+    strptime. Only the date/hour prefix is parsed, the remaining minutes (and
+    seconds) are checked for shape only. Anything unexpected is handed to
+    strptime so errors match the old path.
+    """
+    if not datetime_format.startswith('%m/%d/%Y %H:'):
+        return _time_of_trip_strptime(dateandtime, datetime_format)
+    prefix, sep, rest = dateandtime.rpartition(' ')
+    fields = rest.split(':')
+    # the minutes (and seconds) must be present and in range
+    if (not prefix or len(fields) != datetime_format.count(':') + 1
+            or not all(_is_minute_field(field) for field in fields[1:])):
+        return _time_of_trip_strptime(dateandtime, datetime_format)
+    try:
+        return _start_time_prefix(prefix + ' ' + fields[0])
+    except ValueError:
+        return _time_of_trip_strptime(dateandtime, datetime_format)
+
+def _is_digits(field, max_length):
+    """
+    Returns True if field is one to max_length ASCII digits - int() also
+    takes signs, underscores, spaces and other scripts' digits.
+    """
+    return 0 < len(field) <= max_length and field.isascii() and field.isdigit()
+
+def _is_minute_field(field):
+    """
+    Returns True if field is a valid one or two digit minute/second value.
+    """
+    return _is_digits(field, 2) and int(field) < 60
+
+def _time_of_trip_strptime(dateandtime, datetime_format):
+    """
+    Reference start time parser using datetime.strptime. Kept as the fallback
+    for parse_start_time and as the baseline for benchmark_time_of_trip.
     """
-    # Identify column name and timedate format by city
-    column = ()
-    if city == 'NYC':
-        column = 'starttime'
-        datetime_format = '%m/%d/%Y %H:%M:%S'
-    elif city == 'Chicago':
-        column = 'starttime'
-        datetime_format = '%m/%d/%Y %H:%M'
-    elif city == 'Washington':
-        column = 'Start date'
-        datetime_format = '%m/%d/%Y %H:%M'   
-    # Extract datetime to variable
-    dateandtime = datum[column]   
     # Convert to datetime object format
-    dateeb = datetime.strptime(dateandtime, datetime_format)  
+    dateeb = datetime.strptime(dateandtime, datetime_format)
     # Extract required outputs
     month = dateeb.month
     hour = dateeb.hour
@@ -107,14 +290,54 @@ def time_of_trip(datum, city):
     day_of_week = calendar.day_name[day_of_week]
     return (month, hour, day_of_week)
 
-# A test to check that the code works. There should be no output if all of
-# the assertions pass.
-tests = {'NYC': (1, 0, 'Friday'),
-         'Chicago': (3, 23, 'Thursday'),
-         'Washington': (3, 22, 'Thursday')}
+def time_of_trip(datum, city):
+    """
+    Takes as input a dictionary containing info about a single trip (datum) and
+    its origin city (city) and returns the month, hour, and day of the week in
+    which the trip was made.
+    """
+    # Look up column name and timedate format in the city schema
+    schema = CITY_SCHEMAS[city]
+    # Extract datetime to variable
+    dateandtime = datum[schema['start_time']]
+    # Parse once, repeated date/hour prefixes come from the cache
+    return parse_start_time(dateandtime, schema['start_time_format'])
+
+# Start times benchmark_time_of_trip loads from the start of a raw file
+BENCHMARK_START_TIMES = 1000000
 
-for city in tests:
-    assert time_of_trip(example_trips[city], city) == tests[city]
+def benchmark_time_of_trip(filename, city, repeat=3, max_rows=BENCHMARK_START_TIMES):
+    """
+    This function times the strptime start time parser against the cached
+    parse_start_time on the first max_rows trips of a raw city file (all of
+    them if max_rows is None) and reports the rows per second of each, along
+    with the cache statistics of the fast path. Only those start times are
+    held in memory, however large the file.
+    """
+    from timeit import default_timer as timer
+    # load the raw start times once so only the parsing is timed
+    with open_trip_file(filename) as f_in:
+        trip_reader = csv.reader(f_in)
+        column = next(trip_reader).index(CITY_SCHEMAS[city]['start_time'])
+        start_times = [row[column] for row in islice(trip_reader, max_rows) if row]
+    datetime_format = CITY_SCHEMAS[city]['start_time_format']
+    results = {}
+    for name, parser in (('strptime', _time_of_trip_strptime),
+                         ('cached', parse_start_time)):
+        best = float('inf')
+        for _ in range(repeat):
+            # start each run cold so the cache has to be filled again
+            _start_time_prefix.cache_clear()
+            start = timer()
+            for dateandtime in start_times:
+                parser(dateandtime, datetime_format)
+            best = min(best, timer() - start)
+        results[name] = len(start_times) / best
+    speedup = results['cached'] / results['strptime']
+    print('{}: strptime {:,.0f} rows/s, cached {:,.0f} rows/s ({:.1f}x)'.format(
+        city, results['strptime'], results['cached'], speedup))
+    print('{}: {}'.format(city, _start_time_prefix.cache_info()))
+    return results
 
 def type_of_user(datum, city):
     """
@@ -122,359 +345,4176 @@ def type_of_user(datum, city):
     its origin city (city) and returns the type of system user that made the
     trip.
     """
-    # Identify column name  by city
-    column = ()
-    if city == 'NYC':
-        column = 'usertype'
-    elif city == 'Chicago':
-        column = 'usertype'
-    elif city == 'Washington':
-        column = 'Member Type'   
+    # Look up column name in the city schema
+    schema = CITY_SCHEMAS[city]
     # Extract member/user type
-    user_type = datum[column]
+    user_type = datum[schema['user_type']]
     # Convert to standard format
-    if city =='Washington':
-        if user_type == 'Registered':
-            user_type = 'Subscriber'
-        elif user_type == 'Casual':
-            user_type = 'Customer'
-    return user_type
+    return schema['user_types'].get(user_type, user_type)
+
+def _resolve_schema(header, city, schema=None):
+    """
+    Resolves the columns of a city schema (by default CITY_SCHEMAS[city])
+    against the header row of a raw data file. Returns a function picking the
+    (duration, start time, user type) fields out of a row, the duration
+    divisor, the start time format and the user type renaming function.
+    """
+    from operator import itemgetter
+    if schema is None:
+        schema = CITY_SCHEMAS[city]
+    indices = []
+    for field in ('duration', 'start_time', 'user_type'):
+        if schema[field] not in header:
+            raise ValueError('{} data has no {!r} column'.format(city, schema[field]))
+        indices.append(header.index(schema[field]))
+    return (itemgetter(*indices), schema['duration_divisor'],
+            schema['start_time_format'], schema['user_types'].get)
+
+def _resolve_stations(header, city, station_codes, schema=None):
+    """
+    Resolves the start and end station columns of a city schema against the
+    header row of a raw data file. Returns a function taking a row to the
+    (start, end) station codes of station_codes, a StationCodes.
+    """
+    if schema is None:
+        schema = CITY_SCHEMAS[city]
+    indices = []
+    for field in ('start_station', 'end_station'):
+        if not schema.get(field):
+            raise ValueError('{} has no {} column in its schema'.format(city, field))
+        if schema[field] not in header:
+            raise ValueError('{} data has no {!r} column'.format(city, schema[field]))
+        indices.append(header.index(schema[field]))
+    start_index, end_index = indices
+    code = station_codes.code
+
+    def stations(row):
+        return (code(row[start_index]), code(row[end_index]))
+    return stations
+
+def compile_row_extractor(header, city, station_codes=None, schema=None):
+    """
+    This function resolves the columns of a city schema against the header
+    row of a raw data file once and returns a function that takes a row from
+    a csv.reader and returns its condensed fields in the order of
+    out_colnames: (duration, month, hour, day_of_week, user_type). With
+    station_codes, a StationCodes, the start and end station codes are added
+    as in station_colnames. The schema of the city is looked up in
+    CITY_SCHEMAS unless given, as worker processes started by spawn only see
+    the built in cities there.
+    """
+    columns, divisor, datetime_format, rename_user_type = _resolve_schema(header, city, schema)
+    if station_codes is not None:
+        stations = _resolve_stations(header, city, station_codes, schema)
+
+        def extract_with_stations(row):
+            duration, dateandtime, user_type = columns(row)
+            month, hour, day_of_week = parse_start_time(dateandtime, datetime_format)
+            return (int(duration) / divisor, month, hour, day_of_week,
+                    rename_user_type(user_type, user_type)) + stations(row)
+        return extract_with_stations
+
+    def extract(row):
+        duration, dateandtime, user_type = columns(row)
+        month, hour, day_of_week = parse_start_time(dateandtime, datetime_format)
+        return (int(duration) / divisor, month, hour, day_of_week,
+                rename_user_type(user_type, user_type))
+    return extract
+
+# Column names of the condensed summary files, and of the summaries
+# condensed with stations
+out_colnames = ['duration', 'month', 'hour', 'day_of_week', 'user_type']
+station_colnames = out_colnames + ['start_station', 'end_station']
+
+# Station ids of a summary condensed with stations are written as integer
+# codes, the id of each code is kept in the summary file name plus this
+STATIONS_SUFFIX = '.stations.json'
+
+class StationCodes:
+    """
+    Interns raw station ids (strings) to small integer codes, numbered in
+    order of first appearance. ids[code] is the raw id of a code.
+    """
 
-# A test to check that the code works. There should be no output if all of
-# the assertions pass. 
-tests = {'NYC': 'Customer',
-         'Chicago': 'Subscriber',
-         'Washington': 'Subscriber'}
+    def __init__(self, ids=()):
+        self.ids = list(ids)
+        self._codes = {station: code for code, station in enumerate(self.ids)}
 
-for city in tests:
-    assert type_of_user(example_trips[city], city) == tests[city]
+    def __len__(self):
+        return len(self.ids)
 
-def condense_data(in_file, out_file, city):
+    def code(self, station):
+        """
+        Returns the code of a raw station id, giving it the next free code
+        the first time it is seen.
+        """
+        code = self._codes.get(station)
+        if code is None:
+            code = self._codes[station] = len(self.ids)
+            self.ids.append(station)
+        return code
+
+    def save(self, filename):
+        """
+        Writes the raw ids in code order to filename as json.
+        """
+        temp_file = filename + '.tmp'
+        with open(temp_file, 'w') as f_out:
+            json.dump(self.ids, f_out)
+        os.replace(temp_file, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads station codes saved by save.
+        """
+        with open(filename) as f_in:
+            return cls(json.load(f_in))
+
+# Rows between two calls of a RunProfile progress callback
+PROGRESS_EVERY = 100000
+
+class RunProfile:
+    """
+    Opt-in instrumentation for condense_data and the analysis functions: pass
+    one as their profile argument and it collects the cumulative seconds
+    spent in each stage, counters such as rows read, rows written and
+    malformed rows, and the cache hits and misses. progress, if given, is
+    called as progress(rows, seconds, rows_per_sec) every progress_every
+    rows while condensing. Without a profile none of this is measured.
+    """
+
+    def __init__(self, progress=None, progress_every=PROGRESS_EVERY):
+        from timeit import default_timer as timer
+        self.stages = {}
+        self.counters = {}
+        self.progress = progress
+        self.progress_every = progress_every
+        self._timer = timer
+        self._started = timer()
+
+    def add_time(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def time(self, stage):
+        """
+        Returns a context manager adding the time spent inside it to stage.
+        """
+        from contextlib import contextmanager
+
+        @contextmanager
+        def timed():
+            start = self._timer()
+            try:
+                yield
+            finally:
+                self.add_time(stage, self._timer() - start)
+        return timed()
+
+    def report_progress(self, rows):
+        seconds = self._timer() - self._started
+        self.progress(rows, seconds, rows / seconds if seconds else 0.0)
+
+    def cache_hit_rates(self):
+        """
+        Returns the hit rate of every cache with '<name>_hits' and
+        '<name>_misses' counters.
+        """
+        rates = {}
+        for counter, hits in self.counters.items():
+            if counter.endswith('_hits'):
+                name = counter[:-len('_hits')]
+                lookups = hits + self.counters.get(name + '_misses', 0)
+                rates[name] = hits / lookups if lookups else 0.0
+        return rates
+
+    def to_dict(self):
+        return {'wall_time': self._timer() - self._started,
+                'stages': dict(self.stages),
+                'counters': dict(self.counters),
+                'cache_hit_rates': self.cache_hit_rates()}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+def _timed(profile, stage):
+    """
+    Returns profile.time(stage), or a context manager doing nothing when
+    there is no profile.
+    """
+    from contextlib import nullcontext
+    return nullcontext() if profile is None else profile.time(stage)
+
+def condense_rows(trip_reader, trip_writer, city, cube=None, header=None,
+                  profile=None, station_codes=None, schema=None):
+    """
+    Takes as input a csv reader over raw trips (trip_reader), a csv writer
+    for the condensed data (trip_writer) and the origin city (city) and
+    writes one condensed data point for each trip. The header row is read
+    from trip_reader unless given. Each point is also added to cube, a
+    TripCube, when one is given, and the work is recorded in profile, a
+    RunProfile, when one is given. With station_codes, a StationCodes, the
+    start and end station codes are written after the usual fields. schema
+    is passed on to compile_row_extractor.
+    """
+    if header is None:
+        header = next(trip_reader, None)
+        if header is None:
+            # an empty file has no trips, only the summary header is written
+            return
+    if profile is not None:
+        return _condense_rows_profiled(trip_reader, trip_writer, city, cube,
+                                       header, profile, station_codes, schema)
+    extract = compile_row_extractor(header, city, station_codes, schema)
+    writerow = trip_writer.writerow
+    # collect data from and process each row, skipping blank lines as
+    # csv.DictReader did
+    for row in trip_reader:
+        if not row:
+            continue
+        new_point = extract(row)
+        # write the processed information to the output file
+        writerow(new_point)
+        if cube is not None:
+            cube.add_point(city, new_point)
+
+def _condense_rows_profiled(trip_reader, trip_writer, city, cube, header, profile,
+                            station_codes=None, schema=None):
+    """
+    condense_rows with every stage of every row timed into profile: csv
+    parsing, duration conversion, start time parsing, user type lookup,
+    station lookup (with station_codes), writing and the cube. Rows with
+    more or fewer fields than the header, or whose duration or start time
+    cannot be parsed, are counted as malformed_rows. As in condense_rows, the
+    run stops at the first row that cannot be parsed: it is counted and the
+    stages and counts so far are recorded before its error is raised.
+    """
+    timer = profile._timer
+    columns, divisor, datetime_format, rename_user_type = _resolve_schema(header, city, schema)
+    stations = (_resolve_stations(header, city, station_codes, schema)
+                if station_codes is not None else None)
+    station_time = 0.0
+    writerow = trip_writer.writerow
+    n_fields = len(header)
+    read = duration_time = start_time = user_type_time = write = cube_time = 0.0
+    rows_read = rows_written = malformed = 0
+    next_progress = profile.progress_every if profile.progress else None
+    cache_before = _start_time_prefix.cache_info()
+    trip_reader = iter(trip_reader)
+    try:
+        while True:
+            t0 = timer()
+            row = next(trip_reader, None)
+            t1 = timer()
+            read += t1 - t0
+            if row is None:
+                break
+            if not row:
+                continue
+            rows_read += 1
+            if len(row) != n_fields:
+                malformed += 1
+            try:
+                duration, dateandtime, user_type = columns(row)
+                duration = int(duration) / divisor
+                t2 = timer()
+                month, hour, day_of_week = parse_start_time(dateandtime, datetime_format)
+            except (ValueError, IndexError):
+                # a row with the wrong field count is already counted
+                if len(row) == n_fields:
+                    malformed += 1
+                raise
+            t3 = timer()
+            user_type = rename_user_type(user_type, user_type)
+            t4 = timer()
+            new_point = (duration, month, hour, day_of_week, user_type)
+            if stations is not None:
+                new_point += stations(row)
+                t_stations = timer()
+            duration_time += t2 - t1
+            start_time += t3 - t2
+            user_type_time += t4 - t3
+            if stations is not None:
+                station_time += t_stations - t4
+                t4 = t_stations
+            writerow(new_point)
+            rows_written += 1
+            t5 = timer()
+            write += t5 - t4
+            if cube is not None:
+                cube.add_point(city, new_point)
+                cube_time += timer() - t5
+            if rows_read == next_progress:
+                profile.report_progress(rows_read)
+                next_progress += profile.progress_every
+    finally:
+        cache_after = _start_time_prefix.cache_info()
+        for stage, seconds in (('read', read), ('duration', duration_time),
+                               ('start_time', start_time),
+                               ('user_type', user_type_time), ('write', write),
+                               ('cube', cube_time)):
+            profile.add_time(stage, seconds)
+        if stations is not None:
+            profile.add_time('stations', station_time)
+        profile.count('rows_read', rows_read)
+        profile.count('rows_written', rows_written)
+        profile.count('malformed_rows', malformed)
+        profile.count('start_time_cache_hits', cache_after.hits - cache_before.hits)
+        profile.count('start_time_cache_misses', cache_after.misses - cache_before.misses)
+
+def condense_data(in_file, out_file, city, columnar=False, cube_file=None,
+                  incremental=False, profile=None, partition_dir=None,
+                  pipeline=False, stations=False, od_file=None):
     """
     This function takes full data from the specified input file
     and writes the condensed data to a specified output file. The city
-    argument determines how the input file will be parsed.
+    argument determines how the input file will be parsed. With columnar set
+    the output is written in the columnar binary format (see
+    ColumnarTripWriter) instead of csv. With pipeline set reading, condensing
+    and writing run as overlapping stages (see condense_pipelined). With
+    cube_file set the aggregate cube
+    of the trips (see TripCube) is saved there as well. With incremental set
+    unchanged inputs are skipped and rows appended to the input since the
+    last run are appended to the output (see condense_incremental). With
+    profile set, a RunProfile, the time and counts of every stage are
+    recorded in it. With partition_dir set a partitioned summary (see
+    PartitionedSummary) is written there too. With stations set the start
+    and end station of every trip are kept as integer codes (see
+    station_colnames), with their raw ids saved to out_file +
+    STATIONS_SUFFIX, and with od_file set the origin-destination matrix of
+    the trips (see ODMatrix) is saved there as well.
     """ 
-    with open(out_file, 'w') as f_out, open(in_file, 'r') as f_in:
-        # set up csv DictWriter object - writer requires column names for the
-        # first row as the "fieldnames" argument
-        out_colnames = ['duration', 'month', 'hour', 'day_of_week', 'user_type']        
-        trip_writer = csv.DictWriter(f_out, fieldnames = out_colnames)
-        trip_writer.writeheader()
-        #set up csv DictReader object 
-        trip_reader = csv.DictReader(f_in)
-        # collect data from and process each row
-        for row in trip_reader:
-            # set up a dictionary to hold the values for the cleaned and trimmed
-            # data point
-            new_point = {}
-            new_point['duration'] = duration_in_mins(row, city)
-            new_point['month'] = time_of_trip(row, city)[0]
-            new_point['hour'] = time_of_trip(row, city)[1]
-            new_point['day_of_week'] = time_of_trip(row, city)[2]
-            new_point['user_type'] = type_of_user(row, city)
-            # write the processed information to the output file
-            trip_writer.writerow(new_point)
-            
-# Run this cell to check code works
-city_info = {'Washington': {'in_file': './data/Washington-CapitalBikeshare-2016.csv',
-                            'out_file': './data/Washington-2016-Summary.csv'},
-             'Chicago': {'in_file': './data/Chicago-Divvy-2016.csv',
-                         'out_file': './data/Chicago-2016-Summary.csv'},
-             'NYC': {'in_file': './data/NYC-CitiBike-2016.csv',
-                     'out_file': './data/NYC-2016-Summary.csv'}}
+    if stations or od_file:
+        if incremental or columnar or pipeline or partition_dir:
+            raise ValueError('condensing with stations only supports plain csv output')
+        return _condense_stations(in_file, out_file, city, cube_file, profile,
+                                  od_file)
+    if incremental:
+        if columnar or pipeline:
+            raise ValueError('incremental condensing only supports plain csv output')
+        action = condense_incremental(in_file, out_file, city, cube_file, profile)
+        if partition_dir and (action != 'skip' or not os.path.exists(
+                os.path.join(partition_dir, PARTITION_INDEX))):
+            with _timed(profile, 'partition'):
+                partition_summary(out_file, partition_dir)
+        return action
+    cube = TripCube() if cube_file else None
+    partitions = PartitionedTripWriter(partition_dir) if partition_dir else None
+    if columnar:
+        with open_trip_file(in_file) as f_in:
+            trip_writer = ColumnarTripWriter(out_file)
+            trip_writer.writeheader()
+            try:
+                _condense_stream(f_in, _tee(trip_writer, partitions), city, cube,
+                                 profile, pipeline)
+            except BaseException:
+                trip_writer.discard()
+                raise
+            with _timed(profile, 'write'):
+                trip_writer.close()
+    else:
+        with open_trip_file(out_file, 'w') as f_out, open_trip_file(in_file) as f_in:
+            # set up csv writer object and write the column names as the
+            # first row
+            trip_writer = csv.writer(f_out)
+            trip_writer.writerow(out_colnames)
+            # set up csv reader object, the header is resolved once by
+            # condense_rows
+            _condense_stream(f_in, _tee(trip_writer, partitions), city, cube,
+                             profile, pipeline)
+    invalidate_results(out_file)
+    if partitions is not None:
+        with _timed(profile, 'partition'):
+            partitions.close()
+    if cube is not None:
+        with _timed(profile, 'cube'):
+            cube.save(cube_file)
 
-for city, filenames in city_info.items():
-    condense_data(filenames['in_file'], filenames['out_file'], city)
-    print_first_point(filenames['out_file'])
+def _condense_stations(in_file, out_file, city, cube_file, profile, od_file):
+    """
+    condense_data with stations, writing the station_colnames summary, its
+    station ids and, with od_file, the ODMatrix of the trips.
+    """
+    cube = TripCube() if cube_file else None
+    station_codes = StationCodes()
+    od = ODMatrix(station_codes) if od_file else None
+    with open_trip_file(out_file, 'w') as f_out, open_trip_file(in_file) as f_in:
+        trip_writer = csv.writer(f_out)
+        trip_writer.writerow(station_colnames)
+        condense_rows(csv.reader(f_in), _tee(trip_writer, od), city, cube,
+                      profile=profile, station_codes=station_codes)
+    station_codes.save(out_file + STATIONS_SUFFIX)
+    invalidate_results(out_file)
+    if od is not None:
+        with _timed(profile, 'od_matrix'):
+            od.save(od_file)
+    if cube is not None:
+        with _timed(profile, 'cube'):
+            cube.save(cube_file)
 
-def number_of_trips(filename):
+def _condense_stream(f_in, trip_writer, city, cube, profile, pipeline):
     """
-    This function reads in a file with trip data and reports the number of
-    trips made by subscribers, customers, and total overall.
+    Condenses the raw trips of the open file f_in into trip_writer, through
+    condense_pipelined if pipeline is set and condense_rows otherwise.
     """
-    with open(filename, 'r') as f_in:
-        # set up csv reader object
-        reader = csv.DictReader(f_in)
-        
-        # initialize count variables
-        n_subscribers = 0
-        n_customers = 0
-        # tally up ride types
-        for row in reader:
-            if row['user_type'] == 'Subscriber':
-                n_subscribers += 1
+    if not pipeline:
+        condense_rows(csv.reader(f_in), trip_writer, city, cube, profile=profile)
+        return
+    with _timed(profile, 'pipeline'):
+        rows = condense_pipelined(f_in, trip_writer, city, cube)
+    if profile is not None:
+        profile.count('rows_read', rows)
+        profile.count('rows_written', rows)
+
+# Trips per batch in pipelined mode, the number of transform workers (None
+# for one per core), whether they are processes rather than threads, and how
+# many condensed batches may wait for the writer
+PIPELINE_BATCH_ROWS = 20000
+PIPELINE_WORKERS = None
+PIPELINE_PROCESSES = True
+PIPELINE_QUEUE_BATCHES = 4
+
+def condense_batch(task):
+    """
+    Transform worker for condense_pipelined. Takes as input a tuple of the
+    header row, city, city schema and a list of raw csv lines and returns
+    their condensed rows.
+    """
+    header, city, schema, lines = task
+    extract = compile_row_extractor(header, city, schema=schema)
+    return [extract(row) for row in csv.reader(lines) if row]
+
+def condense_pipelined(f_in, trip_writer, city, cube=None):
+    """
+    This function condenses the raw trips of the open file f_in into
+    trip_writer as three overlapping stages: this thread reads batches of
+    PIPELINE_BATCH_ROWS lines, a pool of PIPELINE_WORKERS transform workers
+    condenses them (condense_batch) and a writer thread hands each batch to
+    trip_writer.writerows, and to cube if given. Batches are written in file
+    order. At most two batches per worker are being condensed and at most
+    PIPELINE_QUEUE_BATCHES wait for the writer, so memory stays bounded
+    however large the input. An error in any stage stops the others and is
+    raised here. Assumes no quoted field spans several lines, as
+    split_line_chunks does. Returns the number of trips condensed.
+    """
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    workers = PIPELINE_WORKERS or os.cpu_count() or 1
+    line = f_in.readline()
+    if not line:
+        # an empty file has no trips
+        return 0
+    header = next(csv.reader([line]))
+    # the workers get the schema itself, cities added with
+    # register_city_schema are unknown to a spawned process
+    schema = CITY_SCHEMAS[city]
+    # check the header before starting any worker
+    compile_row_extractor(header, city, schema=schema)
+    write_queue = queue.Queue(PIPELINE_QUEUE_BATCHES)
+    writer_errors = []
+    n_rows = 0
+
+    def write_batches():
+        try:
+            while True:
+                rows = write_queue.get()
+                if rows is None:
+                    return
+                trip_writer.writerows(rows)
+                if cube is not None:
+                    for new_point in rows:
+                        cube.add_point(city, new_point)
+        except BaseException as error:
+            writer_errors.append(error)
+            # keep taking batches so the reader never waits on a dead writer
+            while write_queue.get() is not None:
+                pass
+
+    writer = threading.Thread(target=write_batches)
+    writer.start()
+    if PIPELINE_PROCESSES:
+        import multiprocessing
+        # spawn, as forking while the writer thread runs is unsafe
+        executor = ProcessPoolExecutor(workers, multiprocessing.get_context('spawn'))
+    else:
+        executor = ThreadPoolExecutor(workers)
+    pending = deque()
+    try:
+        with executor:
+            try:
+                while not writer_errors:
+                    lines = list(islice(f_in, PIPELINE_BATCH_ROWS))
+                    if lines:
+                        pending.append(executor.submit(condense_batch,
+                                                       (header, city, schema, lines)))
+                    # hand condensed batches to the writer in file order,
+                    # waiting on the oldest once enough are in flight
+                    while pending and (len(pending) >= 2 * workers or not lines):
+                        rows = pending.popleft().result()
+                        n_rows += len(rows)
+                        write_queue.put(rows)
+                    if not lines:
+                        break
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+    finally:
+        write_queue.put(None)
+        writer.join()
+    if writer_errors:
+        raise writer_errors[0]
+    return n_rows
+
+# Incremental condensing keeps a manifest next to each output file recording
+# the input it was built from: size, mtime, hashes of the first and last
+# MANIFEST_HASH_BYTES bytes processed and the byte offset processed up to.
+# A last row without a newline is condensed too and recorded as the tail, so
+# it can be cut out of the output and condensed again once the file grows.
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_HASH_BYTES = 64 * 1024
+
+def _hash_range(f_in, start, end):
+    """
+    Returns the sha256 hex digest of the bytes between start and end of an
+    open binary file.
+    """
+    import hashlib
+    f_in.seek(start)
+    return hashlib.sha256(f_in.read(end - start)).hexdigest()
+
+def _input_watermark(in_file):
+    """
+    Returns the byte offset just after the last complete line of in_file. A
+    final line without a newline may still be being written, so anything
+    after the watermark is condensed as the tail (see _condense_tail).
+    Compressed inputs are always taken whole.
+    """
+    if is_compressed(in_file):
+        return os.path.getsize(in_file)
+    with open(in_file, 'rb') as f_in:
+        f_in.seek(0, 2)
+        size = f_in.tell()
+        # look back in blocks for the last newline
+        position = size
+        while position > 0:
+            start = max(0, position - MANIFEST_HASH_BYTES)
+            f_in.seek(start)
+            block = f_in.read(position - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+    return 0
+
+def _input_fingerprint(in_file, watermark):
+    """
+    Returns the manifest entries describing in_file up to watermark.
+    """
+    file_stat = os.stat(in_file)
+    with open(in_file, 'rb') as f_in:
+        head_hash = _hash_range(f_in, 0, min(watermark, MANIFEST_HASH_BYTES))
+        tail_hash = _hash_range(f_in, max(0, watermark - MANIFEST_HASH_BYTES),
+                                watermark)
+    return {'in_file': os.path.abspath(in_file),
+            'size': file_stat.st_size,
+            'mtime_ns': file_stat.st_mtime_ns,
+            'head_hash': head_hash,
+            'tail_hash': tail_hash,
+            'watermark': watermark}
+
+def read_manifest(out_file):
+    """
+    Returns the incremental manifest of an output file, or None if it has
+    none.
+    """
+    try:
+        with open(out_file + MANIFEST_SUFFIX, 'r') as f_in:
+            return json.load(f_in)
+    except (OSError, ValueError):
+        return None
+
+def _condense_tail(in_file, out_file, city, header, watermark, cube=None):
+    """
+    Condenses the last row of in_file when it has no newline, the bytes after
+    watermark, and appends it to out_file and cube. A row with fewer fields
+    than header is still being written and is left for the next run. Returns
+    the manifest entries of the tail (see _write_manifest), or None if nothing
+    was condensed.
+    """
+    import locale
+    if header is None or watermark == 0:
+        # no complete header line, so no trips yet
+        return None
+    with open(in_file, 'rb') as f_in:
+        f_in.seek(watermark)
+        data = f_in.read()
+    row = next(csv.reader([data.decode(locale.getpreferredencoding(False))]), None)
+    if not row or len(row) < len(header):
+        return None
+    new_point = compile_row_extractor(header, city)(row)
+    out_size = os.path.getsize(out_file)
+    with open_trip_file(out_file, 'a') as f_out:
+        csv.writer(f_out).writerow(new_point)
+    if cube is not None:
+        cube.add_point(city, new_point)
+    return {'tail_end': watermark + len(data),
+            'tail_out_size': out_size,
+            'tail_point': list(new_point)}
+
+def _write_manifest(in_file, out_file, city, watermark, tail=None):
+    """
+    Records in the manifest of out_file that in_file has been condensed up to
+    the byte offset watermark, plus the unterminated last row if tail, as
+    returned by _condense_tail, is given.
+    """
+    manifest = _input_fingerprint(in_file, watermark)
+    if tail is not None:
+        manifest.update(tail)
+    manifest['city'] = city
+    manifest['out_size'] = os.path.getsize(out_file)
+    # write then rename so an interrupted run never leaves half a manifest
+    temp_file = out_file + MANIFEST_SUFFIX + '.tmp'
+    with open(temp_file, 'w') as f_out:
+        json.dump(manifest, f_out, indent=2)
+    os.replace(temp_file, out_file + MANIFEST_SUFFIX)
+
+def plan_incremental(in_file, out_file, city, cube_file=None):
+    """
+    This function compares in_file with the manifest of out_file and returns
+    what an incremental condense has to do, along with the byte offset to
+    start from and the new watermark:
+    'skip' - nothing changed since the last run
+    'append' - rows were appended, condense from the old watermark
+    'full' - no usable manifest or the input was rewritten, start over
+    Compressed inputs cannot be resumed at a byte offset, so any change to
+    them means 'full'. An unterminated last row condensed by the previous run
+    is condensed again on any change, as part of the append; a compressed
+    output cannot have that row cut out, so it is rebuilt instead.
+    """
+    manifest = read_manifest(out_file)
+    watermark = _input_watermark(in_file)
+    if (manifest is None or manifest.get('city') != city
+            or manifest.get('in_file') != os.path.abspath(in_file)
+            or not os.path.exists(out_file)
+            or os.path.getsize(out_file) != manifest.get('out_size')
+            or (cube_file and not os.path.exists(cube_file))):
+        return ('full', 0, watermark)
+    old_watermark = manifest['watermark']
+    file_stat = os.stat(in_file)
+    if (file_stat.st_size == manifest['size']
+            and file_stat.st_mtime_ns == manifest['mtime_ns']):
+        # same size and mtime, no need to look at the contents
+        return ('skip', old_watermark, old_watermark)
+    if watermark < old_watermark:
+        return ('full', 0, watermark)
+    # the part of the input already condensed must be untouched
+    old = _input_fingerprint(in_file, old_watermark)
+    if (old['head_hash'] != manifest['head_hash']
+            or old['tail_hash'] != manifest['tail_hash']):
+        return ('full', 0, watermark)
+    if 'tail_end' in manifest and is_compressed(out_file):
+        return ('full', 0, watermark)
+    if (watermark == old_watermark and 'tail_end' not in manifest
+            and file_stat.st_size == watermark):
+        return ('skip', old_watermark, watermark)
+    if is_compressed(in_file):
+        return ('full', 0, watermark)
+    return ('append', old_watermark, watermark)
+
+def _iter_range_lines(f_in, end, encoding):
+    """
+    Yields the decoded lines of an open binary file from its current position
+    up to the byte offset end.
+    """
+    position = f_in.tell()
+    while position < end:
+        line = f_in.readline()
+        if not line:
+            break
+        position += len(line)
+        yield line.decode(encoding)
+
+def condense_incremental(in_file, out_file, city, cube_file=None, profile=None):
+    """
+    This function condenses in_file into out_file, doing as little work as
+    the manifest of out_file allows (see plan_incremental). Appended rows are
+    added to the end of the existing output and cube, and a last row without
+    a newline is condensed too (see _condense_tail). Returns 'skip',
+    'append' or 'full' to say what was done, which is also counted in
+    profile (a RunProfile) if given.
+    """
+    import locale
+    with _timed(profile, 'plan'):
+        action, start, watermark = plan_incremental(in_file, out_file, city, cube_file)
+    if profile is not None:
+        profile.count('incremental_' + action)
+    if action == 'skip':
+        if os.stat(in_file).st_mtime_ns != read_manifest(out_file)['mtime_ns']:
+            # only touched - record the new mtime so the next check is cheap
+            _write_manifest(in_file, out_file, city, watermark)
+        return action
+    cube = TripCube() if cube_file else None
+    tail = None
+    if is_compressed(in_file):
+        # always 'full' - the whole stream is the input
+        with open_trip_file(out_file, 'w') as f_out, open_trip_file(in_file) as f_in:
+            trip_writer = csv.writer(f_out)
+            trip_writer.writerow(out_colnames)
+            condense_rows(csv.reader(f_in), trip_writer, city, cube, profile=profile)
+    else:
+        # decode as open(in_file, 'r') would
+        encoding = locale.getpreferredencoding(False)
+        with open(in_file, 'rb') as f_in:
+            line = f_in.readline()
+            # None for an empty file, which condenses to just the header
+            header = next(csv.reader([line.decode(encoding)])) if line else None
+            if action == 'full':
+                start = f_in.tell()
             else:
-                n_customers += 1
-        # compute total number of rides
-        n_total = n_subscribers + n_customers
-        # return tallies as a tuple
-        return(n_subscribers, n_customers, n_total)
-
-data_file = './examples/BayArea-Y3-Summary.csv'
-city_file = {'Washington':('./data/Washington-2016-Summary.csv'), 'Chicago': ('./data/Chicago-2016-Summary.csv'), 'NYC':('./data/NYC-2016-Summary.csv')}
-    
-Total = {}
-Subscriber_proportion = {}
-Customer_proportion = {}
-    
-for city, filenames in city_file.items():
-    Total[city] = number_of_trips(filenames)[2]
-    Subscriber_proportion[city] = ((number_of_trips(filenames)[0] / number_of_trips(filenames)[2]) * 100)
-    Customer_proportion[city] = ((number_of_trips(filenames)[1] / number_of_trips(filenames)[2]) * 100)
-
-max_total = max(Total, key=Total.get)
-print('City with most trips:', max_total)
-max_subscriber_proportion = max(Subscriber_proportion, key=Subscriber_proportion.get)
-print('City with highest proportion of subscribers:', max_subscriber_proportion)
-max_customer_proportion = max(Customer_proportion, key=Customer_proportion.get)
-print('City with highest proportion of customers:', max_customer_proportion)
-
-def duration_of_trips(filename):
+                manifest = read_manifest(out_file)
+                if 'tail_end' in manifest:
+                    # the last row of the previous run may have been
+                    # incomplete, cut it out and condense it again
+                    with open(out_file, 'r+b') as f_out:
+                        f_out.truncate(manifest['tail_out_size'])
+                    if cube is not None:
+                        cube.remove_point(city, manifest['tail_point'])
+            f_in.seek(start)
+            with open_trip_file(out_file, 'w' if action == 'full' else 'a') as f_out:
+                trip_writer = csv.writer(f_out)
+                if action == 'full':
+                    trip_writer.writerow(out_colnames)
+                trip_reader = csv.reader(_iter_range_lines(f_in, watermark, encoding))
+                condense_rows(trip_reader, trip_writer, city, cube, header, profile)
+        tail = _condense_tail(in_file, out_file, city, header, watermark, cube)
+    invalidate_results(out_file)
+    if cube is not None:
+        with _timed(profile, 'cube'):
+            if action == 'append':
+                cube = TripCube.load(cube_file).merge(cube)
+            cube.save(cube_file)
+    _write_manifest(in_file, out_file, city, watermark, tail)
+    return action
+
+# Columnar summary files start with this magic string, followed by the
+# length of a json header (little-endian uint32), the header itself and then
+# the columns, each aligned to COLUMNAR_ALIGNMENT bytes
+COLUMNAR_MAGIC = b'BIKECOL1'
+COLUMNAR_ALIGNMENT = 64
+# column name, array typecode and numpy dtype of each columnar field
+COLUMNAR_FIELDS = [('duration', 'f', '<f4'),
+                   ('month', 'B', 'u1'),
+                   ('hour', 'B', 'u1'),
+                   ('day_of_week', 'B', 'u1'),
+                   ('user_type', 'B', 'u1')]
+
+# Rows a ColumnarTripWriter buffers in memory before adding them to the
+# temporary file of each column
+COLUMNAR_BUFFER_ROWS = 65536
+
+class ColumnarTripWriter:
     """
-    This function reads in a file with trip data and reports the average trip length and 
-    proportion of rides longer than 30 minutes for each city
+    Writes condensed trips as typed columns: float32 duration, uint8 month,
+    hour and weekday (0 is Monday) and a uint8 user type code. User type names
+    are listed in the header in order of first appearance, so the code of a
+    trip is its position in that list. Has the writerow interface of
+    csv.writer, taking rows in the order of out_colnames, so condense_rows can
+    fill it. Every COLUMNAR_BUFFER_ROWS rows the columns are appended to a
+    temporary file each (out_file plus the column name), so memory does not
+    grow with the number of trips. The file is put together by close().
     """
-    with open(filename, 'r') as f_in:
-        # set up csv reader object
-        reader = csv.DictReader(f_in)
-        # initialize total time and count variables
-        total_minutes = 0
-        total_30 = 0
-        count_trips = 0
-        # convert to float, sum total duration and count
-        for row in reader:
-            if float(row['duration']) > 30:
-                total_minutes += float(row['duration']) 
-                total_30 += 1 #float(row['duration']) 
-                count_trips += 1
+
+    def __init__(self, out_file):
+        self.out_file = out_file
+        self.columns = {name: array.array(typecode)
+                        for name, typecode, dtype in COLUMNAR_FIELDS}
+        self.column_files = {name: open('{}.{}.tmp'.format(out_file, name), 'w+b')
+                             for name, typecode, dtype in COLUMNAR_FIELDS}
+        self.n_rows = 0
+        self.user_types = []
+        self.user_type_codes = {}
+        self.day_codes = {name: code for code, name in
+                          enumerate(calendar.day_name)}
+
+    def writeheader(self):
+        # the header is only known once every row has been seen
+        pass
+
+    def writerow(self, new_point):
+        duration, month, hour, day_of_week, user_type = new_point
+        code = self.user_type_codes.get(user_type)
+        if code is None:
+            code = len(self.user_types)
+            if code > 255:
+                raise ValueError('too many user types for a 1-byte code')
+            self.user_types.append(user_type)
+            self.user_type_codes[user_type] = code
+        columns = self.columns
+        columns['duration'].append(duration)
+        columns['month'].append(month)
+        columns['hour'].append(hour)
+        columns['day_of_week'].append(self.day_codes[day_of_week])
+        columns['user_type'].append(code)
+        if len(columns['duration']) >= COLUMNAR_BUFFER_ROWS:
+            self._flush()
+
+    def writerows(self, rows):
+        for new_point in rows:
+            self.writerow(new_point)
+
+    def _flush(self):
+        """
+        Appends the buffered rows to the column files.
+        """
+        self.n_rows += len(self.columns['duration'])
+        for name, values in self.columns.items():
+            if sys.byteorder != 'little':
+                values.byteswap()
+            values.tofile(self.column_files[name])
+            del values[:]
+
+    def close(self):
+        import shutil
+        self._flush()
+        n_rows = self.n_rows
+        header = {'rows': n_rows, 'user_types': self.user_types, 'columns': []}
+        # work out the aligned offset of every column - the header length
+        # depends on the offsets, so size it with generous placeholders first
+        placeholder = dict(header, columns=[
+            {'name': name, 'dtype': dtype, 'offset': 10 ** 15}
+            for name, typecode, dtype in COLUMNAR_FIELDS])
+        offset = _align(len(COLUMNAR_MAGIC) + 4
+                        + len(json.dumps(placeholder).encode()))
+        for name, typecode, dtype in COLUMNAR_FIELDS:
+            header['columns'].append({'name': name, 'dtype': dtype,
+                                      'offset': offset})
+            offset = _align(offset + n_rows * self.columns[name].itemsize)
+        header_bytes = json.dumps(header).encode()
+        try:
+            with open(self.out_file, 'wb') as f_out:
+                f_out.write(COLUMNAR_MAGIC)
+                f_out.write(struct.pack('<I', len(header_bytes)))
+                f_out.write(header_bytes)
+                for column in header['columns']:
+                    f_out.write(b'\0' * (column['offset'] - f_out.tell()))
+                    column_file = self.column_files[column['name']]
+                    column_file.seek(0)
+                    shutil.copyfileobj(column_file, f_out)
+        finally:
+            self.discard()
+
+    def discard(self):
+        """
+        Closes and removes the column files, e.g. when condensing failed.
+        """
+        for column_file in self.column_files.values():
+            if not column_file.closed:
+                column_file.close()
+                os.remove(column_file.name)
+
+def _align(offset):
+    """
+    Rounds offset up to the next multiple of COLUMNAR_ALIGNMENT.
+    """
+    return -(-offset // COLUMNAR_ALIGNMENT) * COLUMNAR_ALIGNMENT
+
+def is_columnar(filename):
+    """
+    Returns True if filename is a columnar summary file.
+    """
+    with open(filename, 'rb') as f_in:
+        return f_in.read(len(COLUMNAR_MAGIC)) == COLUMNAR_MAGIC
+
+def read_columnar(filename):
+    """
+    This function memory-maps a columnar summary file and returns a dictionary
+    of read-only numpy arrays, one per column, together with the list of user
+    type names indexed by user type code. No data is copied until it is used.
+    """
+    import numpy as np
+    with open(filename, 'rb') as f_in:
+        if f_in.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError('{} is not a columnar summary file'.format(filename))
+        header_length, = struct.unpack('<I', f_in.read(4))
+        header = json.loads(f_in.read(header_length))
+    columns = {}
+    for column in header['columns']:
+        if header['rows'] == 0:
+            # numpy cannot map an empty region
+            columns[column['name']] = np.empty(0, dtype=column['dtype'])
+            continue
+        columns[column['name']] = np.memmap(filename, dtype=column['dtype'],
+                                            mode='r', offset=column['offset'],
+                                            shape=(header['rows'],))
+    return (columns, header['user_types'])
+
+def user_type_code(user_types, user_type):
+    """
+    Returns the code of user_type in a columnar file's user type list, or -1
+    if the file has no trips of that type.
+    """
+    if user_type in user_types:
+        return user_types.index(user_type)
+    return -1
+
+# Rush hours used throughout the analysis: 07:00 to 09:00 and 17:00 to 20:00
+RUSH_HOURS = frozenset([7, 8, 9, 17, 18, 19, 20])
+
+# Days of the week for cube queries
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday')
+WEEKEND = ('Saturday', 'Sunday')
+
+class TripCube:
+    """
+    Trip counts and duration sums over every combination of city, month, hour,
+    day of the week and user type - only a few thousand cells, so questions
+    about the trips are answered without rescanning the summary files.
+    Filled during condense_data (cube_file argument) through add_point,
+    saved with save and read back with TripCube.load. Cubes of different
+    cities or chunks are combined with merge.
+    """
+
+    # order of the cube axes
+    dimensions = ('city', 'month', 'hour', 'day_of_week', 'user_type')
+
+    def __init__(self, cities=(), user_types=('Subscriber', 'Customer')):
+        import numpy as np
+        self.cities = list(cities)
+        self.user_types = list(user_types)
+        shape = (len(self.cities), 12, 24, 7, len(self.user_types))
+        self.counts = np.zeros(shape, dtype='i8')
+        self.minutes = np.zeros(shape, dtype='f8')
+        # trips added since the arrays were last updated, by cell
+        self._pending = {}
+        self._day_codes = {name: code for code, name in enumerate(calendar.day_name)}
+
+    def add_point(self, city, new_point):
+        """
+        Adds a condensed data point (as written by condense_rows, in the
+        order of out_colnames, station codes after them are ignored) of a
+        city.
+        """
+        duration, month, hour, day_of_week, user_type = new_point[:5]
+        key = (city, month, hour, day_of_week, user_type)
+        cell = self._pending.get(key)
+        if cell is None:
+            cell = self._pending[key] = [0, 0]
+        cell[0] += 1
+        cell[1] += duration
+
+    def remove_point(self, city, new_point):
+        """
+        Takes back a data point added with add_point.
+        """
+        duration, month, hour, day_of_week, user_type = new_point[:5]
+        key = (city, month, hour, day_of_week, user_type)
+        cell = self._pending.get(key)
+        if cell is None:
+            cell = self._pending[key] = [0, 0]
+        cell[0] -= 1
+        cell[1] -= duration
+
+    def _flush(self):
+        """
+        Moves the pending trips into the count and duration arrays, adding
+        new cities and user types as needed.
+        """
+        if not self._pending:
+            return
+        for city, month, hour, day_of_week, user_type in list(self._pending):
+            if city not in self.cities:
+                self._grow(0, city)
+            if user_type not in self.user_types:
+                self._grow(4, user_type)
+        removed = False
+        for (city, month, hour, day_of_week, user_type), (count, minutes) in self._pending.items():
+            index = (self.cities.index(city), month - 1, hour,
+                     self._day_codes[day_of_week], self.user_types.index(user_type))
+            self.counts[index] += count
+            self.minutes[index] += minutes
+            removed = removed or count < 0
+        self._pending = {}
+        if removed:
+            self._drop_empty()
+
+    def _drop_empty(self):
+        """
+        Drops the cities and the user types other than Subscriber and
+        Customer left without trips by remove_point, directly or merged.
+        """
+        for axis, labels, keep in ((0, self.cities, ()),
+                                   (4, self.user_types, ('Subscriber', 'Customer'))):
+            other_axes = tuple(i for i in range(5) if i != axis)
+            has_trips = self.counts.any(axis=other_axes)
+            kept = [i for i, label in enumerate(labels) if has_trips[i] or label in keep]
+            if len(kept) < len(labels):
+                labels[:] = [labels[i] for i in kept]
+                self.counts = self.counts.take(kept, axis)
+                self.minutes = self.minutes.take(kept, axis)
+
+    def _grow(self, axis, label):
+        """
+        Appends an empty slice for a new city (axis 0) or user type (axis 4).
+        """
+        import numpy as np
+        labels = self.cities if axis == 0 else self.user_types
+        labels.append(label)
+        shape = list(self.counts.shape)
+        shape[axis] = 1
+        self.counts = np.concatenate([self.counts, np.zeros(shape, 'i8')], axis)
+        self.minutes = np.concatenate([self.minutes, np.zeros(shape, 'f8')], axis)
+
+    def merge(self, other):
+        """
+        Adds the trips of another cube to this one.
+        """
+        self._flush()
+        other._flush()
+        for city in other.cities:
+            if city not in self.cities:
+                self._grow(0, city)
+        for user_type in other.user_types:
+            if user_type not in self.user_types:
+                self._grow(4, user_type)
+        city_index = [self.cities.index(city) for city in other.cities]
+        user_index = [self.user_types.index(user_type) for user_type in other.user_types]
+        for source, target in ((other.counts, self.counts),
+                               (other.minutes, self.minutes)):
+            for i, city in enumerate(city_index):
+                for j, user_type in enumerate(user_index):
+                    target[city, :, :, :, user_type] += source[i, :, :, :, j]
+        if (other.counts < 0).any():
+            self._drop_empty()
+        return self
+
+    def save(self, cube_file):
+        """
+        Saves the cube to cube_file as a numpy .npz archive.
+        """
+        import numpy as np
+        self._flush()
+        with open(cube_file, 'wb') as f_out:
+            np.savez(f_out, counts=self.counts, minutes=self.minutes,
+                     cities=np.array(self.cities, dtype=str),
+                     user_types=np.array(self.user_types, dtype=str))
+
+    @classmethod
+    def load(cls, cube_file):
+        """
+        Reads a cube saved by save.
+        """
+        import numpy as np
+        with np.load(cube_file) as archive:
+            cube = cls(archive['cities'].tolist(), archive['user_types'].tolist())
+            cube.counts = archive['counts']
+            cube.minutes = archive['minutes']
+        return cube
+
+    def _selection(self, axis, value):
+        """
+        Returns the indices along axis picked by a query value: None for all,
+        a single label or an iterable of labels. Months are 1-12, hours 0-23
+        and days of the week are names or codes (0 is Monday); anything else
+        raises ValueError. Unknown cities and user types select nothing.
+        """
+        size = self.counts.shape[axis]
+        if value is None:
+            return list(range(size))
+        if isinstance(value, (str, int)):
+            value = [value]
+        indices = []
+        for label in value:
+            if axis == 0:
+                index = self.cities.index(label) if label in self.cities else None
+            elif axis == 1:
+                index = label - 1
+            elif axis == 2:
+                index = label
+            elif axis == 3:
+                index = self._day_codes.get(label, -1) if isinstance(label, str) else label
             else:
-                total_minutes += float(row['duration']) 
-                count_trips += 1        
-        # finds average and proportion over 30
-        avg_trip = total_minutes / count_trips
-        avg_trip = round(avg_trip, 1)
-        proportion_over30 = (total_30 / count_trips) * 100
-        proportion_over30 = round(proportion_over30, 1)
-        return(avg_trip, proportion_over30)
-
-data_file = './examples/BayArea-Y3-Summary.csv'
-city_file = {'Washington':('./data/Washington-2016-Summary.csv'), 'Chicago': ('./data/Chicago-2016-Summary.csv'), 'NYC':('./data/NYC-2016-Summary.csv')}
-        
-for city, filename in city_file.items():
-    duration_of_trips(filename)
-    print('{} has an average trip duration of {} minutes with {} % of rides over 30 minutes'.format(city, duration_of_trips(filename)[0], duration_of_trips(filename)[1]))
+                index = (self.user_types.index(label)
+                         if label in self.user_types else None)
+            if axis in (1, 2, 3) and not 0 <= index < size:
+                raise ValueError('no {} {!r} in the cube'.format(self.dimensions[axis], label))
+            if index is not None:
+                indices.append(index)
+        return indices
 
-# Within Chicago, customers have a significantly longer average trip duration of 41.7 minutes compared to subscribers at just 12.5 minutes.                                            ##
+    def roll_up(self, keep=(), **filters):
+        """
+        Slices the cube by filters (city, month, hour, day_of_week, user_type)
+        and sums over every dimension not named in keep. Returns the counts
+        and duration sums as arrays with the kept dimensions, in cube order.
+        """
+        import numpy as np
+        self._flush()
+        for name in list(filters) + list(keep):
+            if name not in self.dimensions:
+                raise ValueError('unknown cube dimension {!r}'.format(name))
+        counts = self.counts
+        minutes = self.minutes
+        for axis, name in enumerate(self.dimensions):
+            indices = self._selection(axis, filters.get(name))
+            counts = counts.take(indices, axis=axis)
+            minutes = minutes.take(indices, axis=axis)
+        summed = tuple(axis for axis, name in enumerate(self.dimensions)
+                       if name not in keep)
+        return (counts.sum(axis=summed), minutes.sum(axis=summed))
+
+    def query(self, **filters):
+        """
+        Returns the number of trips and their total duration in minutes for
+        a slice of the cube, for example the subscriber trips in NYC during
+        rush hours on weekdays:
+        cube.query(city='NYC', hour=RUSH_HOURS, day_of_week=WEEKDAYS,
+                   user_type='Subscriber')
+        """
+        counts, minutes = self.roll_up(**filters)
+        return (int(counts), float(minutes))
+
+    def mean_duration(self, **filters):
+        """
+        Returns the average trip duration in minutes of a slice of the cube,
+        or None if it has no trips.
+        """
+        count, minutes = self.query(**filters)
+        return minutes / count if count else None
+
+# Hour bands of the origin-destination matrix: the rush hours of RUSH_HOURS
+# split into the morning and evening commutes, the middle of the day and the
+# night
+HOUR_BANDS = (('am_rush', (7, 8, 9)),
+              ('midday', (10, 11, 12, 13, 14, 15, 16)),
+              ('pm_rush', (17, 18, 19, 20)),
+              ('night', (21, 22, 23, 0, 1, 2, 3, 4, 5, 6)))
+
+# Bits of an ODMatrix cell key taken by each station code
+OD_STATION_BITS = 20
 
-def usertype_average(filename):
+class ODMatrix:
     """
-    This function reads file and returns trip data of different user types
+    Sparse trip counts and duration sums between every pair of stations, by
+    user type and hour band (HOUR_BANDS). Only station pairs with trips are
+    stored, each cell under a single integer key packing the user type,
+    hour band, origin and destination codes. Filled from rows in the order
+    of station_colnames through writerow (so condense_rows can write to it)
+    or add, saved with save and read back with ODMatrix.load. Matrices of
+    different chunks, workers or files are combined with merge, which
+    matches stations by their raw ids.
     """
-    with open(filename, 'r') as f_in:
-        # set up csv reader object
-        reader = csv.DictReader(f_in)
-        # initialize total time and count variables by usertype
-        sub_total_minutes = 0
-        cus_total_minutes = 0
-        sub_count_trips = 0
-        cus_count_trips = 0
-        # convert to float, sum total duration and count
-        for row in reader:
-            if row['user_type'] == 'Subscriber':
-                sub_total_minutes += float(row['duration'])  
-                sub_count_trips += 1
-            elif row['user_type'] == 'Customer':
-                cus_total_minutes += float(row['duration']) 
-                cus_count_trips += 1    
-        # finds average duration by user
-        sub_avg_trip = sub_total_minutes / sub_count_trips
-        sub_avg_trip = round(sub_avg_trip, 1)
-        cus_avg_trip = cus_total_minutes / cus_count_trips
-        cus_avg_trip = round(cus_avg_trip, 1)
-        return(sub_avg_trip, cus_avg_trip)    
-
-city_file = {'Washington':('./data/Washington-2016-Summary.csv'), 'Chicago': ('./data/Chicago-2016-Summary.csv'), 'NYC':('./data/NYC-2016-Summary.csv')}
-        
-for city, filename in city_file.items():
-    usertype_average(filename)
-    print('{} : Subscribers have an average trip duration of {} minutes, Customers have an average trip duration of {} minutes '.format(city, usertype_average(filename)[0], usertype_average(filename)[1]))
-    
-# load graphic library
-import matplotlib.pyplot as plt
-
-# example histogram, data taken from bay area sample
-data = [ 7.65,  8.92,  7.42,  5.50, 16.17,  4.20,  8.98,  9.62, 11.48, 14.33,
-        19.02, 21.53,  3.90,  7.97,  2.62,  2.67,  3.08, 14.40, 12.90,  7.83,
-        25.12,  8.30,  4.93, 12.43, 10.60,  6.17, 10.88,  4.78, 15.15,  3.53,
-         9.43, 13.32, 11.72,  9.85,  5.22, 15.10,  3.95,  3.17,  8.78,  1.88,
-         4.55, 12.68, 12.38,  9.78,  7.63,  6.45, 17.38, 11.90, 11.52,  8.63,]
-plt.hist(data)
-plt.title('Distribution of Trip Durations')
-plt.xlabel('Duration (m)')
-plt.show()
 
-def plot_all(filename):
+    def __init__(self, station_codes=None, user_types=('Subscriber', 'Customer'),
+                 hour_bands=HOUR_BANDS):
+        self.stations = station_codes if station_codes is not None else StationCodes()
+        self.user_types = list(user_types)
+        self._user_codes = {user_type: code for code, user_type in enumerate(self.user_types)}
+        self.hour_bands = [name for name, hours in hour_bands]
+        self._band_of_hour = [None] * 24
+        for band, (name, hours) in enumerate(hour_bands):
+            for hour in hours:
+                self._band_of_hour[hour] = band
+        # [count, minutes] of each cell by key
+        self.cells = {}
+
+    def _user_code(self, user_type):
+        """
+        Returns the code of a user type, adding it if it is new.
+        """
+        code = self._user_codes.get(user_type)
+        if code is None:
+            code = self._user_codes[user_type] = len(self.user_types)
+            self.user_types.append(user_type)
+        return code
+
+    def _key(self, user, band, origin, destination):
+        return ((((user * len(self.hour_bands) + band) << OD_STATION_BITS | origin)
+                 << OD_STATION_BITS) | destination)
+
+    def _unpack(self, key):
+        """
+        Returns the (user type code, hour band code, origin, destination) of
+        a cell key.
+        """
+        mask = (1 << OD_STATION_BITS) - 1
+        destination = key & mask
+        origin = (key >> OD_STATION_BITS) & mask
+        user, band = divmod(key >> 2 * OD_STATION_BITS, len(self.hour_bands))
+        return (user, band, origin, destination)
+
+    def add(self, origin, destination, hour, user_type, duration, count=1):
+        """
+        Adds count trips of a user type starting in hour from the station
+        code origin to destination, lasting duration minutes in total.
+        """
+        if max(origin, destination) >> OD_STATION_BITS:
+            raise ValueError('too many stations for an ODMatrix')
+        key = self._key(self._user_code(user_type), self._band_of_hour[hour],
+                        origin, destination)
+        cell = self.cells.get(key)
+        if cell is None:
+            self.cells[key] = [count, duration]
+        else:
+            cell[0] += count
+            cell[1] += duration
+
+    def writerow(self, new_point):
+        duration, month, hour, day_of_week, user_type, origin, destination = new_point
+        self.add(origin, destination, hour, user_type, duration)
+
+    def writerows(self, rows):
+        for new_point in rows:
+            self.writerow(new_point)
+
+    def merge(self, other):
+        """
+        Adds the trips of another matrix to this one. Both must use the same
+        hour bands.
+        """
+        if other.hour_bands != self.hour_bands:
+            raise ValueError('cannot merge matrices with different hour bands')
+        station_map = [self.stations.code(station) for station in other.stations.ids]
+        user_map = [self._user_code(user_type) for user_type in other.user_types]
+        cells = self.cells
+        for key, (count, minutes) in other.cells.items():
+            user, band, origin, destination = other._unpack(key)
+            key = self._key(user_map[user], band, station_map[origin],
+                            station_map[destination])
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = [count, minutes]
+            else:
+                cell[0] += count
+                cell[1] += minutes
+        return self
+
+    def save(self, od_file):
+        """
+        Saves the matrix to od_file as a numpy .npz archive.
+        """
+        import numpy as np
+        keys = np.fromiter(self.cells, dtype='i8', count=len(self.cells))
+        values = list(self.cells.values())
+        with open(od_file, 'wb') as f_out:
+            np.savez(f_out, keys=keys,
+                     counts=np.array([cell[0] for cell in values], dtype='i8'),
+                     minutes=np.array([cell[1] for cell in values], dtype='f8'),
+                     stations=np.array(self.stations.ids, dtype=str),
+                     user_types=np.array(self.user_types, dtype=str),
+                     hour_bands=np.array(self.hour_bands, dtype=str))
+
+    @classmethod
+    def load(cls, od_file):
+        """
+        Reads a matrix saved by save. Hour bands keep their names and the
+        hours of HOUR_BANDS.
+        """
+        import numpy as np
+        bands = dict(HOUR_BANDS)
+        with np.load(od_file) as archive:
+            od = cls(StationCodes(archive['stations'].tolist()),
+                     archive['user_types'].tolist(),
+                     [(name, bands.get(name, ())) for name in archive['hour_bands'].tolist()])
+            od.cells = {key: [count, minutes] for key, count, minutes in zip(
+                archive['keys'].tolist(), archive['counts'].tolist(),
+                archive['minutes'].tolist())}
+        return od
+
+    def _selected(self, user_type, hour_band):
+        """
+        Returns the set of packed (user type, hour band) prefixes picked by a
+        user type and hour band, each None for all, a single name or an
+        iterable of names.
+        """
+        selections = []
+        for value, labels in ((user_type, self.user_types), (hour_band, self.hour_bands)):
+            if value is None:
+                selections.append(range(len(labels)))
+                continue
+            if isinstance(value, str):
+                value = [value]
+            selections.append([labels.index(label) for label in value if label in labels])
+        users, bands = selections
+        return {user * len(self.hour_bands) + band for user in users for band in bands}
+
+    def _iter_cells(self, user_type=None, hour_band=None):
+        """
+        Yields the (origin, destination, count, minutes) of every cell in a
+        selection, see _selected.
+        """
+        selected = self._selected(user_type, hour_band)
+        mask = (1 << OD_STATION_BITS) - 1
+        for key, (count, minutes) in self.cells.items():
+            if key >> 2 * OD_STATION_BITS in selected:
+                yield ((key >> OD_STATION_BITS) & mask, key & mask, count, minutes)
+
+    def top_flows(self, n=10, user_type=None, hour_band=None):
+        """
+        Returns the n station pairs with the most trips for a user type and
+        hour band (each None for all, a name or a list of names) as a list of
+        (origin id, destination id, trips, average minutes), busiest first.
+        """
+        import heapq
+        flows = {}
+        for origin, destination, count, minutes in self._iter_cells(user_type, hour_band):
+            flow = flows.get((origin, destination))
+            if flow is None:
+                flows[(origin, destination)] = [count, minutes]
+            else:
+                flow[0] += count
+                flow[1] += minutes
+        ids = self.stations.ids
+        return [(ids[origin], ids[destination], count, minutes / count)
+                for (origin, destination), (count, minutes) in heapq.nlargest(
+                    n, flows.items(), key=lambda flow: flow[1][0])]
+
+    def station_imbalance(self, hour_band='am_rush', user_type=None, n=None):
+        """
+        Returns the departures, arrivals and net arrivals (arrivals minus
+        departures) of every station for a user type and hour band, as a list
+        of (station id, departures, arrivals, net) with the largest imbalance
+        (in either direction) first, cut to n stations if given. During the
+        morning rush stations with a large positive net fill up and those
+        with a large negative net run out of bikes.
+        """
+        import heapq
+        departures = [0] * len(self.stations)
+        arrivals = [0] * len(self.stations)
+        for origin, destination, count, minutes in self._iter_cells(user_type, hour_band):
+            departures[origin] += count
+            arrivals[destination] += count
+        imbalance = [(station, departures[code], arrivals[code],
+                      arrivals[code] - departures[code])
+                     for code, station in enumerate(self.stations.ids)
+                     if departures[code] or arrivals[code]]
+        if n is None:
+            return sorted(imbalance, key=lambda station: -abs(station[3]))
+        return heapq.nlargest(n, imbalance, key=lambda station: abs(station[3]))
+
+# Partitioned summaries are a directory of csv files, one per month and user
+# type, and an index (PARTITION_INDEX) with min/max statistics of each
+# partition and of each row group in it. A row group holds the trips of one
+# hour, written out whenever a partition has buffered PARTITION_GROUP_ROWS
+# trips and sorted by day of the week, with the byte length of each day
+# recorded, so queries on hours and days also skip most of each partition
+PARTITION_INDEX = 'index.json'
+PARTITION_GROUP_ROWS = 32768
+
+def partition_dir_of(out_file):
     """
-    This function reads file and plots all trip times on histogram
+    Returns the default partitioned summary directory of a summary file,
+    e.g. ./data/NYC-2016-Summary-partitions.
     """
-    get_ipython().run_line_magic('matplotlib', 'inline')
-    with open(filename, 'r') as f_in:
-        # set up csv reader object
-        reader = csv.DictReader(f_in)
-        # initialize date collection vairable
-        data = []    
-        # convert to float and add to collection varable
-        for row in reader:
-                data.append(float(row['duration']))  
-        # create histogram
-        plt.hist(data)
-        plt.title('Distribution of Trip Durations')
-        plt.xlabel('Duration (m)')
-        plt.show() 
-        return    
+    if is_compressed(out_file):
+        out_file = os.path.splitext(out_file)[0]
+    return os.path.splitext(out_file)[0] + '-partitions'
 
-city_file = {'Washington':('./data/Washington-2016-Summary.csv')}
-        
-for city, filename in city_file.items():
-    plot_all(filename)
+def _extend_range(bounds, low, high):
+    """
+    Returns the [min, max] bounds widened to cover low and high.
+    """
+    if bounds is None:
+        return [low, high]
+    return [min(bounds[0], low), max(bounds[1], high)]
+
+class PartitionedTripWriter:
+    """
+    Writes condensed trips as a partitioned summary in partition_dir (see
+    PARTITION_INDEX). Has the writerow interface of csv.writer, taking rows
+    in the order of out_colnames, so condense_rows can fill it. The index is
+    written by close().
+    """
 
-import numpy as np
+    def __init__(self, partition_dir):
+        self.partition_dir = partition_dir
+        os.makedirs(partition_dir, exist_ok=True)
+        # remove the index first so a half written directory is never read,
+        # then the partitions of any earlier run
+        if os.path.exists(os.path.join(partition_dir, PARTITION_INDEX)):
+            os.remove(os.path.join(partition_dir, PARTITION_INDEX))
+        for name in os.listdir(partition_dir):
+            if name.startswith('part-') and name.endswith('.csv'):
+                os.remove(os.path.join(partition_dir, name))
+        self.day_codes = {name: code for code, name in enumerate(calendar.day_name)}
+        self.partitions = {}
+        # per partition key: the open file, its buffered rows by hour and
+        # the number of rows buffered
+        self._files = {}
+        self._buffers = {}
+        self._buffered = {}
 
-def plot_all(filename):
+    def writerow(self, new_point):
+        key = (new_point[1], new_point[4])
+        buffers = self._buffers.get(key)
+        if buffers is None:
+            buffers = self._open(key)
+        group = buffers.get(new_point[2])
+        if group is None:
+            group = buffers[new_point[2]] = []
+        group.append(new_point)
+        self._buffered[key] += 1
+        if self._buffered[key] >= PARTITION_GROUP_ROWS:
+            self._flush(key)
+
+    def writerows(self, rows):
+        for new_point in rows:
+            self.writerow(new_point)
+
+    def _open(self, key):
+        month, user_type = key
+        name = 'part-{:04d}.csv'.format(len(self.partitions))
+        f_out = open(os.path.join(self.partition_dir, name), 'wb')
+        header = io.StringIO()
+        csv.writer(header).writerow(out_colnames)
+        f_out.write(header.getvalue().encode('utf-8'))
+        self.partitions[key] = {'file': name, 'month': month, 'user_type': user_type,
+                                'rows': 0, 'stats': {}, 'groups': []}
+        self._files[key] = f_out
+        self._buffers[key] = {}
+        self._buffered[key] = 0
+        return self._buffers[key]
+
+    def _flush(self, key):
+        """
+        Writes the buffered rows of a partition as one row group per hour.
+        """
+        f_out = self._files[key]
+        partition = self.partitions[key]
+        for hour, rows in sorted(self._buffers[key].items()):
+            by_day = [[] for day in calendar.day_name]
+            for row in rows:
+                by_day[self.day_codes[row[3]]].append(row)
+            offset = f_out.tell()
+            day_lengths = []
+            for day_rows in by_day:
+                text = io.StringIO()
+                csv.writer(text).writerows(day_rows)
+                data = text.getvalue().encode('utf-8')
+                f_out.write(data)
+                day_lengths.append(len(data))
+            durations = [row[0] for row in rows]
+            days = [day for day, day_rows in enumerate(by_day) if day_rows]
+            stats = {'duration': [min(durations), max(durations)],
+                     'hour': [hour, hour],
+                     'day_of_week': [min(days), max(days)]}
+            partition['groups'].append({'offset': offset, 'length': sum(day_lengths),
+                                        'day_lengths': day_lengths,
+                                        'rows': len(rows), 'stats': stats})
+            partition['rows'] += len(rows)
+            for name, (low, high) in stats.items():
+                partition['stats'][name] = _extend_range(partition['stats'].get(name),
+                                                         low, high)
+        self._buffers[key] = {}
+        self._buffered[key] = 0
+
+    def close(self):
+        for key in self._files:
+            self._flush(key)
+            self._files[key].close()
+        index = {'partitions': sorted(self.partitions.values(),
+                                      key=lambda partition: partition['file'])}
+        temp_file = os.path.join(self.partition_dir, PARTITION_INDEX + '.tmp')
+        with open(temp_file, 'w') as f_out:
+            json.dump(index, f_out)
+        os.replace(temp_file, os.path.join(self.partition_dir, PARTITION_INDEX))
+
+class _TeeWriter:
     """
-    This function reads file and plots all trip times on histogram
+    Passes every row written to it on to each of writers.
     """
-    get_ipython().run_line_magic('matplotlib', 'inline')
-    with open(filename, 'r') as f_in:
-        # set up csv reader object
-        reader = csv.DictReader(f_in)
-        # initialize date collection vairable
-        data_sub = []
-        data_cus = []  
-        # convert to float and add to collection varable
-        for row in reader:
-            if row['user_type'] == 'Subscriber':
-                if float(row['duration']) < 75:
-                    data_sub.append(float(row['duration'])) 
-            elif row['user_type'] == 'Customer': 
-                if float(row['duration']) < 75:
-                    data_cus.append(float(row['duration']))      
-        # create histogram
-        plt.hist(data_sub, rwidth=1)
-        plt.title('Distribution of Trip Durations for Subscribers')
-        plt.xlabel('Duration (m)')
-        plt.show()
-        plt.hist(data_cus, rwidth=1)
-        plt.title('Distribution of Trip Durations for Customers')
-        plt.xlabel('Duration (m)')
-        plt.show()               
-        return    
 
-city_file = {'Washington':('./data/Washington-2016-Summary.csv')}
-        
-for city, filename in city_file.items():
-    plot_all(filename)
+    def __init__(self, writers):
+        self.writers = writers
 
-# One question that was explored was how usage during rush hours (set as 07:00 to 09:00 and 17:00 to 20:00) changed during weekdays versus weekends for both subscribers and customers in NYC. 
-# The aim of this was show how usage habits changed for both usertypes at different stages of the week.
-# 
-# The results are show below 
-# Subscribers: *57.3%* of weekday trips and *50.7%* of weekend trips were during rush hours respectively 
-# Customers: *29.59%* of weekday trips and *30.52%* of weekend trips were during rush hours respectively 
-# It is highly likely that subscribers use bike sharing for commuting to work far more than customers who appear to use bikes more consistently through out the day. 
-# Furthermore subscriber habits change more notably during weekends with a drop of usage during rushour of 6.6% compared to a slight rise of 0.93% for customers. 
-# Considering that most users are subscribers, a potential action point from this analysis is to ensure increased availablity during rushhours on weekdays. 
-# Also consider using a marketing strategy that emphasises *leisure* use for non-commuting activity to attract new customers while targeting exisitng customers with *commuting* advantages offered by bike sharing to convert them into subscribers.
+    def writerow(self, row):
+        for writer in self.writers:
+            writer.writerow(row)
 
-import numpy as np
-import matplotlib.pyplot as plt
-get_ipython().run_line_magic('matplotlib', 'inline')
+    def writerows(self, rows):
+        for writer in self.writers:
+            writer.writerows(rows)
 
-def plot_analysis(filename):
+def _tee(trip_writer, partitions):
     """
-    This function plots the proportion of usgae in work hours vs non work hours for on weekdays and weekend for
-    subscribers and customers
+    Returns trip_writer, also writing to partitions if that is not None.
     """
-    with open(filename, 'r') as f_in:
-        # set up csv reader object
-        reader = csv.DictReader(f_in)
-        reader2 = csv.DictReader(f_in)
-        # initialize date collection vairables
-        sub_weekday_rush_count = 0
-        sub_weekday_total_count = 0
-        sub_weekend_rush_count = 0
-        sub_weekend_total_count = 0
-        cus_weekday_rush_count = 0
-        cus_weekday_total_count = 0
-        cus_weekend_rush_count = 0
-        cus_weekend_total_count = 0        
-        # convert to int and add to respective collection varables
+    return trip_writer if partitions is None else _TeeWriter([trip_writer, partitions])
+
+def partition_summary(filename, partition_dir=None):
+    """
+    This function writes the partitioned summary of an existing csv summary
+    file to partition_dir (by default partition_dir_of(filename)), for
+    summaries condensed in parallel or incrementally.
+    """
+    if partition_dir is None:
+        partition_dir = partition_dir_of(filename)
+    trip_writer = PartitionedTripWriter(partition_dir)
+    with open_trip_file(filename) as f_in:
+        reader = csv.reader(f_in)
+        header = next(reader)
+        indices = [header.index(name) for name in out_colnames]
         for row in reader:
-            if (7 <= float(row['hour']) <= 9) or (17 <= float(row['hour']) <= 20):
-                if str(row['day_of_week']) == ('Monday' or 'Tuesday' or 'Wednesday' or 'Thursday' or 'Friday'):
-                    if str(row['user_type']) == 'Subscriber':
-                        sub_weekday_rush_count += 1
-                        sub_weekday_total_count += 1
-                    elif str(row['user_type']) == 'Customer':
-                        cus_weekday_rush_count += 1
-                        cus_weekday_total_count += 1     
-                else:
-                    if str(row['user_type']) == 'Subscriber':
-                        sub_weekend_rush_count += 1
-                        sub_weekend_total_count += 1
-                    elif str(row['user_type']) == 'Customer':
-                        cus_weekend_rush_count += 1
-                        cus_weekend_total_count += 1    
-            else:
-                if str(row['day_of_week']) == ('Monday' or 'Tuesday' or 'Wednesday' or 'Thursday' or 'Friday'):
-                    if str(row['user_type']) == 'Subscriber':
-                        sub_weekday_total_count += 1
-                    elif str(row['user_type']) == 'Customer':
-                        cus_weekday_total_count += 1     
+            duration, month, hour, day_of_week, user_type = [row[i] for i in indices]
+            trip_writer.writerow((float(duration), int(month), int(hour),
+                                  day_of_week, user_type))
+    trip_writer.close()
+
+class PartitionedSummary:
+    """
+    Reads a partitioned summary written by PartitionedTripWriter. Queries
+    take the filters month (1-12), hour (0-23), day_of_week (names or codes,
+    0 is Monday) and user_type, each a single value or an iterable such as
+    range(7, 10) or RUSH_HOURS, and min_duration / max_duration in minutes.
+    Partitions and row groups whose min/max statistics rule out a match are
+    skipped without being read.
+    """
+
+    def __init__(self, partition_dir):
+        self.partition_dir = partition_dir
+        with open(os.path.join(partition_dir, PARTITION_INDEX)) as f_in:
+            self.partitions = json.load(f_in)['partitions']
+        self._day_codes = {name: code for code, name in enumerate(calendar.day_name)}
+
+    def _filters(self, month=None, hour=None, day_of_week=None, user_type=None,
+                 min_duration=None, max_duration=None):
+        """
+        Returns the filters as sets of allowed values (None for any) and the
+        duration bounds.
+        """
+        def allowed(value):
+            if value is None:
+                return None
+            if isinstance(value, (str, int)):
+                value = [value]
+            return set(value)
+        days = allowed(day_of_week)
+        if days is not None:
+            days = {self._day_codes[day] if isinstance(day, str) else day
+                    for day in days}
+        return (allowed(month), allowed(hour), days, allowed(user_type),
+                -math.inf if min_duration is None else min_duration,
+                math.inf if max_duration is None else max_duration)
+
+    def _may_match(self, stats, filters):
+        """
+        Returns False if min/max statistics show no trip can match filters.
+        """
+        months, hours, days, user_types, min_duration, max_duration = filters
+        if stats['duration'][1] < min_duration or stats['duration'][0] > max_duration:
+            return False
+        for allowed, (low, high) in ((hours, stats['hour']), (days, stats['day_of_week'])):
+            if allowed is not None and not any(low <= value <= high for value in allowed):
+                return False
+        return True
+
+    def select(self, profile=None, **filters):
+        """
+        Returns the (partition, row group) pairs that may hold trips matching
+        filters. With profile set, a RunProfile, the partitions and row groups
+        read and skipped are counted in it.
+        """
+        filters = self._filters(**filters)
+        months, hours, days, user_types, min_duration, max_duration = filters
+        selected = []
+        for partition in self.partitions:
+            if ((months is not None and partition['month'] not in months)
+                    or (user_types is not None and partition['user_type'] not in user_types)
+                    or not partition['rows']
+                    or not self._may_match(partition['stats'], filters)):
+                if profile is not None:
+                    profile.count('partitions_skipped')
+                continue
+            groups = [group for group in partition['groups']
+                      if self._may_match(group['stats'], filters)]
+            if profile is not None:
+                profile.count('partitions_read')
+                profile.count('row_groups_read', len(groups))
+                profile.count('row_groups_skipped', len(partition['groups']) - len(groups))
+            selected.extend((partition, group) for group in groups)
+        return selected
+
+    def rows(self, profile=None, **filters):
+        """
+        Yields the condensed trips (duration, month, hour, day_of_week,
+        user_type) matching filters, reading only the row groups picked by
+        select, and only the days asked for within them.
+        """
+        from itertools import accumulate
+        selected = self.select(profile, **filters)
+        months, hours, days, user_types, min_duration, max_duration = self._filters(**filters)
+        day_codes = self._day_codes
+        open_file = None
+        try:
+            for partition, group in selected:
+                if open_file is None or open_file.name != os.path.join(
+                        self.partition_dir, partition['file']):
+                    if open_file is not None:
+                        open_file.close()
+                    open_file = open(os.path.join(self.partition_dir,
+                                                  partition['file']), 'rb')
+                if days is None:
+                    ranges = [(group['offset'], group['length'])]
                 else:
-                    if str(row['user_type']) == 'Subscriber':
-                        sub_weekend_total_count += 1
-                    elif str(row['user_type']) == 'Customer':
-                        cus_weekend_total_count += 1 
-        sub_weekday_output = (sub_weekday_rush_count / sub_weekday_total_count) * 100
-        sub_weekend_output = (sub_weekend_rush_count / sub_weekend_total_count) * 100     
-        cus_weekday_output = (cus_weekday_rush_count / cus_weekday_total_count) * 100
-        cus_weekend_output = (cus_weekend_rush_count / cus_weekend_total_count) * 100    
-        sub_weekday_output = round(sub_weekday_output, 2)
-        sub_weekend_output = round(sub_weekend_output, 2)
-        cus_weekday_output = round(cus_weekday_output, 2)
-        cus_weekend_output = round(cus_weekend_output, 2)
-        # data to plot
-        n_groups = 2
-        data_1 = []
-        data_1.append(sub_weekday_output)
-        data_1.append(cus_weekday_output)
-        data_2 = []
-        data_2.append(sub_weekend_output)
-        data_2.append(cus_weekend_output)      
-        # create plot
-        fig, ax = plt.subplots()
-        index = np.arange(n_groups)
-        bar_width = 0.35
-        opacity = 0.8
-        rects1 = plt.bar(index, data_1, bar_width, alpha=opacity, color='b',label='% of rush hours trips on weekdays')
-        rects2 = plt.bar(index + bar_width, data_2, bar_width, alpha=opacity, color='g', label='% of rush hours trips on weekends')
-        plt.xlabel('User Type')
-        plt.ylabel('% of trips in rush hours')
-        plt.title('NYC Rush Hour Usage Weekday vs Weekends')
-        plt.xticks(index + (0.5 * bar_width) , ('Subscribers', 'Customers')) #
-        plt.legend()
-        plt.tight_layout()
-        plt.show()
-        print('For subscribers, {}% of weekday trips and {}% of weekend trips were during rush hours respectively'.format(sub_weekday_output, sub_weekend_output))
-        print('For customers, {}% of weekday trips and {}% of weekend trips were during rush hours respectively'.format(cus_weekday_output, cus_weekend_output))
-        return
+                    # only the days asked for
+                    starts = list(accumulate(group['day_lengths'], initial=group['offset']))
+                    ranges = [(starts[day], group['day_lengths'][day])
+                              for day in sorted(days) if 0 <= day < 7]
+                data = b''
+                for offset, length in ranges:
+                    open_file.seek(offset)
+                    data += open_file.read(length)
+                if profile is not None:
+                    profile.count('bytes_read', len(data))
+                for duration, month, hour, day_of_week, user_type in csv.reader(
+                        io.StringIO(data.decode('utf-8'))):
+                    duration = float(duration)
+                    hour = int(hour)
+                    if ((hours is None or hour in hours)
+                            and (days is None or day_codes[day_of_week] in days)
+                            and min_duration <= duration <= max_duration):
+                        yield (duration, int(month), hour, day_of_week, user_type)
+        finally:
+            if open_file is not None:
+                open_file.close()
+
+    def stats(self, profile=None, **filters):
+        """
+        Returns a TripStats of the trips matching filters.
+        """
+        stats = TripStats()
+        for duration, month, hour, day_of_week, user_type in self.rows(profile, **filters):
+            stats.add(duration, hour, day_of_week, user_type)
+        return stats
+
+    def query(self, profile=None, **filters):
+        """
+        Returns the number of trips matching filters and their total duration
+        in minutes, as TripCube.query does. For example the subscriber trips
+        in June during the morning rush hour:
+        summary.query(month=6, hour=range(7, 10), user_type='Subscriber')
+        """
+        count = 0
+        minutes = 0
+        for duration, month, hour, day_of_week, user_type in self.rows(profile, **filters):
+            count += 1
+            minutes += duration
+        return (count, minutes)
+
+# Size of the byte ranges each worker condenses in parallel mode
+CONDENSE_CHUNK_SIZE = 64 * 1024 * 1024
+
+def split_line_chunks(in_file, chunk_size=CONDENSE_CHUNK_SIZE, end=None):
+    """
+    This function splits a raw csv file into byte ranges of roughly chunk_size
+    bytes that start and end on line boundaries. Returns the header row and a
+    list of (start, end) byte offsets covering every line after the header,
+    stopping at the byte offset end if given. Assumes no quoted field spans
+    several lines, which holds for the Motivate trip files.
+    """
+    with open(in_file, 'rb') as f_in:
+        header = next(csv.reader([f_in.readline().decode()]))
+        data_start = f_in.tell()
+        f_in.seek(0, 2)
+        file_size = f_in.tell() if end is None else end
+        # move each cut forward to the start of the next line
+        offsets = [data_start]
+        target = data_start + chunk_size
+        while target < file_size:
+            f_in.seek(target - 1)
+            f_in.readline()
+            offset = f_in.tell()
+            if offset >= file_size:
+                break
+            offsets.append(offset)
+            target = offset + chunk_size
+        offsets.append(file_size)
+    chunks = [(start, end) for start, end in zip(offsets, offsets[1:])
+              if end > start]
+    return (header, chunks)
+
+def condense_chunk(task):
+    """
+    Worker for the parallel condense. Takes as input a tuple of the raw input
+    file, city, city schema, header row, a (start, end) byte range and
+    whether to build a cube. Returns the condensed rows of that range as csv
+    text without a header, and their TripCube or None.
+    """
+    in_file, city, schema, header, start, end, with_cube = task
+    with open(in_file, 'rb') as f_in:
+        f_in.seek(start)
+        data = f_in.read(end - start)
+    # decode and split lines exactly as open(in_file, 'r') would
+    f_in = io.TextIOWrapper(io.BytesIO(data))
+    f_out = io.StringIO()
+    trip_writer = csv.writer(f_out)
+    trip_reader = csv.reader(f_in)
+    cube = TripCube() if with_cube else None
+    condense_rows(trip_reader, trip_writer, city, cube, header, schema=schema)
+    return (f_out.getvalue(), cube)
+
+def condense_whole(task):
+    """
+    Worker for the parallel condense of a compressed input. Takes as input a
+    tuple of the city, its schema and the arguments and keyword arguments of
+    condense_data, registers the schema in this process and condenses the
+    whole file.
+    """
+    city, schema, args, kwargs = task
+    CITY_SCHEMAS[city] = schema
+    return condense_data(*args, **kwargs)
+
+def condense_cities_parallel(city_info, processes=None,
+                             chunk_size=CONDENSE_CHUNK_SIZE, incremental=False):
+    """
+    This function condenses the input file of every city in city_info into its
+    output file using a process pool. Each input file is split into line
+    aligned chunks, all chunks of all cities are shared out over the pool and
+    the results are written back in order under a single header, so the output
+    is byte-identical to condense_data. Cities with a 'cube_file' entry also
+    get their aggregate cube saved, as with condense_data. With incremental
+    set unchanged cities are skipped, appended rows are condensed on their own
+    and only rewritten inputs go through the pool. Compressed inputs cannot be
+    split, so each is condensed whole by a single worker.
+    """
+    from multiprocessing import Pool
+    whole_files = {city: filenames for city, filenames in city_info.items()
+                   if is_compressed(filenames['in_file'])}
+    city_info = {city: filenames for city, filenames in city_info.items()
+                 if city not in whole_files}
+    watermarks = {}
+    if incremental:
+        for city, filenames in list(city_info.items()):
+            action, start, watermark = plan_incremental(
+                filenames['in_file'], filenames['out_file'], city,
+                filenames.get('cube_file'))
+            if action == 'full':
+                watermarks[city] = watermark
+            else:
+                condense_incremental(filenames['in_file'], filenames['out_file'],
+                                     city, filenames.get('cube_file'))
+                del city_info[city]
+    if not city_info and not whole_files:
+        return
+    tasks = []
+    n_chunks = {}
+    headers = {}
+    for city, filenames in city_info.items():
+        header, chunks = split_line_chunks(filenames['in_file'], chunk_size,
+                                           watermarks.get(city))
+        headers[city] = header
+        n_chunks[city] = len(chunks)
+        for start, end in chunks:
+            tasks.append((filenames['in_file'], city, CITY_SCHEMAS[city], header,
+                          start, end, bool(filenames.get('cube_file'))))
+    with Pool(processes) as pool:
+        whole_results = [pool.apply_async(condense_whole, ((
+            city, CITY_SCHEMAS[city], (filenames['in_file'], filenames['out_file'], city),
+            {'cube_file': filenames.get('cube_file'), 'incremental': incremental}),))
+            for city, filenames in whole_files.items()]
+        # imap hands back results in task order, so each city's chunks
+        # arrive one after the other and in file order
+        results = pool.imap(condense_chunk, tasks)
+        for city, filenames in city_info.items():
+            cube = TripCube() if filenames.get('cube_file') else None
+            with open_trip_file(filenames['out_file'], 'w') as f_out:
+                csv.writer(f_out).writerow(out_colnames)
+                for _ in range(n_chunks[city]):
+                    text, chunk_cube = next(results)
+                    f_out.write(text)
+                    if cube is not None:
+                        cube.merge(chunk_cube)
+            tail = None
+            if incremental:
+                # the chunks stop at the watermark, add an unterminated last row
+                tail = _condense_tail(filenames['in_file'], filenames['out_file'], city,
+                                      headers[city], watermarks[city], cube)
+            invalidate_results(filenames['out_file'])
+            if cube is not None:
+                cube.save(filenames['cube_file'])
+            if incremental:
+                _write_manifest(filenames['in_file'], filenames['out_file'],
+                                city, watermarks[city], tail)
+        for result in whole_results:
+            result.get()
+    for filenames in whole_files.values():
+        invalidate_results(filenames['out_file'])
+
+def condense_data_parallel(in_file, out_file, city, processes=None,
+                           chunk_size=CONDENSE_CHUNK_SIZE, cube_file=None):
+    """
+    Parallel version of condense_data for a single city, see
+    condense_cities_parallel.
+    """
+    condense_cities_parallel({city: {'in_file': in_file, 'out_file': out_file,
+                                     'cube_file': cube_file}},
+                             processes, chunk_size)
+
+def station_files_of(out_file):
+    """
+    Returns the default summary with stations and origin-destination matrix
+    files of a summary file, e.g. ./data/NYC-2016-Summary-stations.csv and
+    ./data/NYC-2016-Summary-od.npz.
+    """
+    if is_compressed(out_file):
+        out_file = os.path.splitext(out_file)[0]
+    stem = os.path.splitext(out_file)[0]
+    return (stem + '-stations.csv', stem + '-od.npz')
+
+def _add_od_rows(od, reader, header):
+    """
+    Adds the rows of a csv reader over a summary condensed with stations,
+    whose column names are header, to od, an ODMatrix.
+    """
+    if 'start_station' not in header:
+        raise ValueError('summary was not condensed with stations')
+    indices = [header.index(name) for name in ('duration', 'hour', 'user_type',
+                                               'start_station', 'end_station')]
+    add = od.add
+    for row in reader:
+        duration, hour, user_type, origin, destination = [row[i] for i in indices]
+        add(int(origin), int(destination), int(hour), user_type, float(duration))
+
+def od_chunk(task):
+    """
+    Worker for od_matrix. Takes as input a tuple of a summary file condensed
+    with stations, its header row, station ids and hour bands and a (start,
+    end) byte range and returns the ODMatrix of the trips in that range.
+    """
+    filename, header, station_ids, hour_bands, start, end = task
+    with open(filename, 'rb') as f_in:
+        f_in.seek(start)
+        data = f_in.read(end - start)
+    od = ODMatrix(StationCodes(station_ids), hour_bands=hour_bands)
+    _add_od_rows(od, csv.reader(io.TextIOWrapper(io.BytesIO(data))), header)
+    return od
+
+def od_matrix(filename, processes=1, chunk_size=CONDENSE_CHUNK_SIZE,
+              hour_bands=None):
+    """
+    This function builds the ODMatrix of a summary file condensed with
+    stations, over hour_bands (by default HOUR_BANDS), in one streaming pass.
+    With processes other than 1 the file is split into line aligned chunks
+    whose matrices are built by a process pool (None for all cores) and
+    merged. Compressed summaries are always read in a single pass.
+    """
+    if hour_bands is None:
+        hour_bands = HOUR_BANDS
+    station_ids = StationCodes.load(filename + STATIONS_SUFFIX).ids
+    od = ODMatrix(StationCodes(station_ids), hour_bands=hour_bands)
+    if processes == 1 or is_compressed(filename):
+        with open_trip_file(filename) as f_in:
+            reader = csv.reader(f_in)
+            _add_od_rows(od, reader, next(reader))
+        return od
+    from multiprocessing import Pool
+    header, chunks = split_line_chunks(filename, chunk_size)
+    # the hour bands go with each task, a spawned worker only sees the
+    # default HOUR_BANDS
+    tasks = [(filename, header, station_ids, hour_bands, start, end)
+             for start, end in chunks]
+    with Pool(processes) as pool:
+        for chunk_od in pool.imap(od_chunk, tasks):
+            od.merge(chunk_od)
+    return od
+
+# Raw input, summary and cube files of each city
+city_info = {'Washington': {'in_file': './data/Washington-CapitalBikeshare-2016.csv',
+                            'out_file': './data/Washington-2016-Summary.csv',
+                            'cube_file': './data/Washington-2016-Cube.npz'},
+             'Chicago': {'in_file': './data/Chicago-Divvy-2016.csv',
+                         'out_file': './data/Chicago-2016-Summary.csv',
+                         'cube_file': './data/Chicago-2016-Cube.npz'},
+             'NYC': {'in_file': './data/NYC-CitiBike-2016.csv',
+                     'out_file': './data/NYC-2016-Summary.csv',
+                     'cube_file': './data/NYC-2016-Cube.npz'}}
+
+class TripStats:
+    """
+    Accumulates every statistic the analysis reports on a summary file in a
+    single pass: trip counts and duration totals by user type, trips over 30
+    minutes and rush hour counts split by weekday and weekend. Use
+    summarise_trips to build one for a file, number_of_trips,
+    duration_of_trips, usertype_average and rush_hour_counts are views over it.
+    Stats from several files or chunks can be combined with merge.
+    """
+
+    def __init__(self):
+        self.n_trips = 0
+        self.total_minutes = 0
+        self.n_over30 = 0
+        # per user type: trip count and total duration
+        self.user_counts = {}
+        self.user_minutes = {}
+        # per (user type, is weekday): [rush hour trips, all trips]
+        self.rush_counts = {}
+
+    def add(self, duration, hour, day_of_week, user_type):
+        """
+        Adds a single condensed trip.
+        """
+        self.n_trips += 1
+        self.total_minutes += duration
+        if duration > 30:
+            self.n_over30 += 1
+        self.user_counts[user_type] = self.user_counts.get(user_type, 0) + 1
+        self.user_minutes[user_type] = self.user_minutes.get(user_type, 0) + duration
+        # as in the original analysis only Monday is counted as a weekday
+        key = (user_type, day_of_week == 'Monday')
+        counts = self.rush_counts.get(key)
+        if counts is None:
+            counts = self.rush_counts[key] = [0, 0]
+        if hour in RUSH_HOURS:
+            counts[0] += 1
+        counts[1] += 1
+
+    def merge(self, other):
+        """
+        Adds the trips counted by another TripStats to this one.
+        """
+        self.n_trips += other.n_trips
+        self.total_minutes += other.total_minutes
+        self.n_over30 += other.n_over30
+        for user_type, count in other.user_counts.items():
+            self.user_counts[user_type] = self.user_counts.get(user_type, 0) + count
+        for user_type, minutes in other.user_minutes.items():
+            self.user_minutes[user_type] = self.user_minutes.get(user_type, 0) + minutes
+        for key, (rush, total) in other.rush_counts.items():
+            counts = self.rush_counts.setdefault(key, [0, 0])
+            counts[0] += rush
+            counts[1] += total
+        return self
+
+    def subtract(self, other):
+        """
+        Removes the trips counted by another TripStats, previously merged or
+        added to this one.
+        """
+        self.n_trips -= other.n_trips
+        self.total_minutes -= other.total_minutes
+        self.n_over30 -= other.n_over30
+        for user_type, count in other.user_counts.items():
+            self.user_counts[user_type] -= count
+        for user_type, minutes in other.user_minutes.items():
+            self.user_minutes[user_type] -= minutes
+        for key, (rush, total) in other.rush_counts.items():
+            counts = self.rush_counts[key]
+            counts[0] -= rush
+            counts[1] -= total
+        return self
+
+    def trip_counts(self):
+        """
+        Returns the number of subscriber trips, other trips and all trips.
+        """
+        n_subscribers = self.user_counts.get('Subscriber', 0)
+        return (n_subscribers, self.n_trips - n_subscribers, self.n_trips)
+
+    def duration_summary(self):
+        """
+        Returns the average trip duration and the percentage of trips over 30
+        minutes, both rounded to one decimal place.
+        """
+        avg_trip = round(self.total_minutes / self.n_trips, 1)
+        proportion_over30 = round((self.n_over30 / self.n_trips) * 100, 1)
+        return (avg_trip, proportion_over30)
+
+    def average_duration(self, user_type):
+        """
+        Returns the average trip duration of one user type, rounded to one
+        decimal place.
+        """
+        return round(self.user_minutes[user_type] / self.user_counts[user_type], 1)
+
+    def rush_hour_counts(self):
+        """
+        Returns the rush hour and total trip counts for subscribers and
+        customers on weekdays and weekends, in the order used by plot_analysis.
+        """
+        counts = []
+        for user_type in ('Subscriber', 'Customer'):
+            for is_weekday in (True, False):
+                counts.extend(self.rush_counts.get((user_type, is_weekday), [0, 0]))
+        return tuple(counts)
+
+# summarise_trips results by file path, with the size and modification time
+# of the file they were computed from
+_trip_stats_cache = {}
+
+# How csv summary files are scanned: 'python' goes row by row, 'numpy' loads
+# SUMMARY_BLOCK_ROWS rows at a time into numpy arrays and uses masked
+# reductions. Both give identical results.
+analysis_backend = 'python'
+SUMMARY_BLOCK_ROWS = 100000
+
+def summarise_trips(filename, backend=None, profile=None):
+    """
+    This function reads a condensed summary file (csv or columnar) once and
+    returns a TripStats with every statistic of the analysis. Results are
+    remembered until the file changes, so repeated questions about the same
+    file do not rescan it. backend overrides analysis_backend for csv files.
+    With profile set, a RunProfile, the time spent reading, the rows read and
+    the result cache hits and misses are recorded in it.
+    """
+    if backend is None:
+        backend = analysis_backend
+    file_stat = os.stat(filename)
+    identity = (file_stat.st_size, file_stat.st_mtime_ns)
+    cached = _trip_stats_cache.get(os.path.abspath(filename))
+    if cached is not None and cached[0] == identity:
+        if profile is not None:
+            profile.count('summary_cache_hits')
+        return cached[1]
+    if profile is not None:
+        profile.count('summary_cache_misses')
+        with profile.time('summarise'):
+            stats = summarise_trips(filename, backend)
+        profile.count('rows_read', stats.n_trips)
+        return stats
+    if is_columnar(filename):
+        stats = _summarise_columnar(filename)
+    elif backend == 'numpy':
+        stats = _summarise_csv_numpy(filename)
+    elif backend == 'python':
+        stats = _summarise_csv(filename)
+    else:
+        raise ValueError('unknown analysis backend {!r}'.format(backend))
+    _trip_stats_cache[os.path.abspath(filename)] = (identity, stats)
+    return stats
+
+def _summarise_csv(filename):
+    """
+    Builds the TripStats of a csv summary file row by row.
+    """
+    stats = TripStats()
+    with open_trip_file(filename) as f_in:
+        # set up csv reader object
+        reader = csv.reader(f_in)
+        header = next(reader)
+        duration_index = header.index('duration')
+        hour_index = header.index('hour')
+        day_index = header.index('day_of_week')
+        user_index = header.index('user_type')
+        add = stats.add
+        for row in reader:
+            add(float(row[duration_index]), int(row[hour_index]),
+                row[day_index], row[user_index])
+    return stats
+
+def iter_summary_blocks(filename, block_rows=None):
+    """
+    This function reads a csv summary file about block_rows rows at a time.
+    Each block is yielded as a dictionary of numpy arrays laid out as in
+    read_columnar (float64 duration, uint8 month, hour, day of the week and
+    user type codes) together with the user type names of that block.
+    Summary fields never need quoting, so blocks are split on commas and
+    newlines directly. Blocks with quotes or blank lines go through csv.reader.
+    """
+    import numpy as np
+    if block_rows is None:
+        block_rows = SUMMARY_BLOCK_ROWS
+    day_codes = {name: code for code, name in enumerate(calendar.day_name)}
+    with open_trip_file(filename) as f_in:
+        header = next(csv.reader([f_in.readline()]))
+        indices = {name: header.index(name) for name in out_colnames}
+        n_columns = len(header)
+        # roughly 32 characters per condensed row
+        block_size = block_rows * 32
+        remainder = ''
+        while True:
+            chunk = f_in.read(block_size)
+            text = remainder + chunk
+            if chunk:
+                # keep any partial last line for the next block
+                end = text.rfind('\n') + 1
+                text, remainder = text[:end], text[end:]
+            else:
+                remainder = ''
+            if not text:
+                if not chunk:
+                    break
+                continue
+            if '"' in text or '\n\n' in text or text.startswith('\n'):
+                # csv.reader handles quoting and skips blank lines
+                rows = list(csv.reader(io.StringIO(text)))
+                fields = [field for row in rows for field in row]
+            else:
+                fields = text.replace('\n', ',').split(',')
+                # drop the empty field left by the final newline
+                if text.endswith('\n'):
+                    fields.pop()
+            if len(fields) % n_columns:
+                raise ValueError('malformed summary file {}'.format(filename))
+            n_rows = len(fields) // n_columns
+            def column(name):
+                return fields[indices[name]::n_columns]
+            def encode(values, codes):
+                return np.fromiter(map(codes.__getitem__, values), 'u1', n_rows)
+            columns = {'duration': np.array(column('duration'), dtype='f8')}
+            # small integer columns are converted once per distinct value
+            for name in ('month', 'hour'):
+                values = column(name)
+                columns[name] = encode(values, {value: int(value)
+                                                for value in set(values)})
+            columns['day_of_week'] = encode(column('day_of_week'), day_codes)
+            user_types = sorted(set(column('user_type')))
+            columns['user_type'] = encode(column('user_type'), {
+                user_type: code for code, user_type in enumerate(user_types)})
+            yield (columns, user_types)
+
+def _running_sum(total, values):
+    """
+    Adds values to total one after the other, as a Python loop would. cumsum
+    is sequential, unlike sum, so the result matches the row by row backend
+    to the last bit.
+    """
+    import numpy as np
+    if len(values) == 0:
+        return total
+    return float(np.cumsum(np.concatenate(([total], values)))[-1])
+
+def _add_columns(stats, columns, user_types):
+    """
+    Adds a block of trips, laid out as returned by read_columnar or
+    iter_summary_blocks, to a TripStats using masked numpy reductions.
+    """
+    import numpy as np
+    duration = columns['duration']
+    stats.n_trips += len(duration)
+    stats.total_minutes = _running_sum(stats.total_minutes, duration)
+    stats.n_over30 += int((duration > 30).sum())
+    rush = np.isin(columns['hour'], list(RUSH_HOURS))
+    # day code 0 is Monday, the only day counted as a weekday by the
+    # original analysis
+    weekday = columns['day_of_week'] == 0
+    for code, user_type in enumerate(user_types):
+        user = columns['user_type'] == code
+        stats.user_counts[user_type] = (stats.user_counts.get(user_type, 0)
+                                        + int(user.sum()))
+        stats.user_minutes[user_type] = _running_sum(
+            stats.user_minutes.get(user_type, 0), duration[user])
+        for is_weekday, day_mask in ((True, weekday), (False, ~weekday)):
+            total = user & day_mask
+            n_total = int(total.sum())
+            if n_total:
+                counts = stats.rush_counts.setdefault((user_type, is_weekday), [0, 0])
+                counts[0] += int((total & rush).sum())
+                counts[1] += n_total
+    return stats
+
+def _summarise_csv_numpy(filename):
+    """
+    Builds the TripStats of a csv summary file from numpy blocks.
+    """
+    stats = TripStats()
+    for columns, user_types in iter_summary_blocks(filename):
+        _add_columns(stats, columns, user_types)
+    return stats
+
+def _summarise_columnar(filename):
+    """
+    Builds the TripStats of a columnar summary file with numpy reductions.
+    """
+    columns, user_types = read_columnar(filename)
+    return _add_columns(TripStats(), columns, user_types)
+
+class DurationHistogram:
+    """
+    Streaming histogram of trip durations over fixed bin edges. Bins are half
+    open, [edge, next edge), durations outside the edges are only counted as
+    underflow or overflow, so memory does not grow with the number of trips.
+    Feed it one duration at a time with add or a numpy array with add_many,
+    and combine histograms of several files or workers with merge.
+    """
+
+    def __init__(self, edges):
+        self.edges = [float(edge) for edge in edges]
+        self.counts = [0] * (len(self.edges) - 1)
+        self.underflow = 0
+        self.overflow = 0
+
+    @classmethod
+    def linear(cls, low, high, n_bins):
+        """
+        Histogram with n_bins equal width bins from low to high.
+        """
+        width = (high - low) / n_bins
+        return cls([low + width * i for i in range(n_bins)] + [high])
+
+    @classmethod
+    def log(cls, low, high, n_bins):
+        """
+        Histogram with n_bins log-spaced bins from low to high.
+        """
+        ratio = (high / low) ** (1 / n_bins)
+        return cls([low * ratio ** i for i in range(n_bins)] + [high])
+
+    def empty_copy(self):
+        """
+        Returns an empty histogram with the same bins.
+        """
+        return DurationHistogram(self.edges)
+
+    def add(self, duration):
+        if duration < self.edges[0]:
+            self.underflow += 1
+        elif duration >= self.edges[-1]:
+            self.overflow += 1
+        else:
+            self.counts[bisect_right(self.edges, duration) - 1] += 1
+
+    def add_many(self, durations):
+        import numpy as np
+        bins = np.searchsorted(self.edges, durations, side='right') - 1
+        self.underflow += int((bins < 0).sum())
+        self.overflow += int((bins >= len(self.counts)).sum())
+        inside = bins[(bins >= 0) & (bins < len(self.counts))]
+        for index, count in enumerate(np.bincount(inside, minlength=len(self.counts)).tolist()):
+            self.counts[index] += count
+
+    def merge(self, other):
+        if other.edges != self.edges:
+            raise ValueError('cannot merge histograms with different bins')
+        self.counts = [count + other_count for count, other_count
+                       in zip(self.counts, other.counts)]
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def plot(self, ax=None, **kwargs):
+        """
+        Draws the histogram with matplotlib, as plt.hist would draw the
+        durations it was fed, on the axes ax if given.
+        """
+        if ax is None:
+            ax = _pyplot()
+        return ax.hist(self.edges[:-1], bins=self.edges, weights=self.counts, **kwargs)
+
+class QuantileSketch:
+    """
+    Mergeable sketch of trip durations that answers quantile queries (median,
+    p95, p99) to within relative_accuracy, using log-spaced buckets in the
+    style of DDSketch. At most max_buckets buckets are kept - beyond that the
+    lowest buckets are folded together, so only the smallest durations lose
+    accuracy.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        # bucket index -> count, bucket i holds (gamma^(i-1), gamma^i]
+        self.buckets = {}
+        # durations of zero (or below) are kept apart
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, duration):
+        self.count += 1
+        if duration <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(duration) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def add_many(self, durations):
+        import numpy as np
+        durations = np.asarray(durations, dtype='f8')
+        self.count += len(durations)
+        positive = durations[durations > 0]
+        self.zero_count += len(durations) - len(positive)
+        indices = np.ceil(np.log(positive) / self._log_gamma).astype('i8')
+        values, counts = np.unique(indices, return_counts=True)
+        for index, count in zip(values.tolist(), counts.tolist()):
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        """
+        Folds the lowest buckets into one until max_buckets remain.
+        """
+        indices = sorted(self.buckets)
+        n_extra = len(indices) - self.max_buckets
+        target = indices[n_extra]
+        for index in indices[:n_extra]:
+            self.buckets[target] += self.buckets.pop(index)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError('cannot merge sketches with different accuracy')
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        return self
+
+    def quantile(self, q):
+        """
+        Returns the estimated q quantile (0 <= q <= 1) of the durations added,
+        or None if the sketch is empty.
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # midpoint of the bucket in relative terms
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+# Key for the accumulators over every user type in duration_distribution
+ALL_USERS = 'All'
+
+def duration_distribution(filename, histogram, *more_histograms):
+    """
+    This function streams the trip durations of a summary file (csv or
+    columnar) into an empty copy of histogram (and of each of
+    more_histograms, for several bin sets in the same pass) and a
+    QuantileSketch for each user type and for all trips (ALL_USERS). Memory
+    use does not depend on the size of the file. Returns the dictionary of
+    histograms by user type (a tuple of them, one per bin set, when
+    more_histograms are given) and the dictionary of sketches by user type.
+    """
+    bin_sets = (histogram,) + more_histograms
+    histograms = tuple({} for _ in bin_sets)
+    sketches = {}
+    # every accumulator of a user type, so each duration is added in one loop
+    user_accumulators = {}
+    def accumulators(user_type):
+        if user_type not in user_accumulators:
+            for by_user, bins in zip(histograms, bin_sets):
+                by_user[user_type] = bins.empty_copy()
+            sketches[user_type] = QuantileSketch()
+            user_accumulators[user_type] = ([by_user[user_type] for by_user in histograms]
+                                            + [sketches[user_type]])
+        return user_accumulators[user_type]
+    all_accumulators = accumulators(ALL_USERS)
+    if is_columnar(filename) or analysis_backend == 'numpy':
+        if is_columnar(filename):
+            columns, user_types = read_columnar(filename)
+            blocks = ((dict((name, values[start:start + SUMMARY_BLOCK_ROWS])
+                            for name, values in columns.items()), user_types)
+                      for start in range(0, len(columns['duration']), SUMMARY_BLOCK_ROWS))
+        else:
+            blocks = iter_summary_blocks(filename)
+        for columns, user_types in blocks:
+            duration = columns['duration']
+            for accumulator in all_accumulators:
+                accumulator.add_many(duration)
+            for code, user_type in enumerate(user_types):
+                user_duration = duration[columns['user_type'] == code]
+                for accumulator in accumulators(user_type):
+                    accumulator.add_many(user_duration)
+    else:
+        with open_trip_file(filename) as f_in:
+            reader = csv.reader(f_in)
+            header = next(reader)
+            duration_index = header.index('duration')
+            user_index = header.index('user_type')
+            for row in reader:
+                duration = float(row[duration_index])
+                for accumulator in all_accumulators:
+                    accumulator.add(duration)
+                for accumulator in accumulators(row[user_index]):
+                    accumulator.add(duration)
+    if more_histograms:
+        return (histograms, sketches)
+    return (histograms[0], sketches)
+
+def benchmark_analysis_backends(filename, repeat=3):
+    """
+    This function times summarise_trips on a csv summary file with the python
+    and numpy backends, checks that both give the same statistics and reports
+    the rows per second of each. Use files of 10M+ rows for stable numbers.
+    """
+    from timeit import default_timer as timer
+    results = {}
+    outputs = {}
+    for backend in ('python', 'numpy'):
+        best = float('inf')
+        for _ in range(repeat):
+            # drop the remembered result so every run rescans the file
+            _trip_stats_cache.clear()
+            start = timer()
+            stats = summarise_trips(filename, backend)
+            best = min(best, timer() - start)
+        results[backend] = stats.n_trips / best
+        outputs[backend] = (stats.trip_counts(), stats.duration_summary(),
+                            stats.rush_hour_counts(), stats.user_minutes)
+    _trip_stats_cache.clear()
+    assert outputs['python'] == outputs['numpy'], 'backends disagree on ' + filename
+    print('{}: python {:,.0f} rows/s, numpy {:,.0f} rows/s ({:.1f}x)'.format(
+        filename, results['python'], results['numpy'],
+        results['numpy'] / results['python']))
+    return results
+
+# Persistent cache of analysis results across runs (see cached_result), an
+# sqlite database of at most RESULT_CACHE_MAX_BYTES of results, the least
+# recently used evicted first. Set result_cache_file to None to turn it off.
+result_cache_file = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'bike_share_analysis', 'results.sqlite')
+RESULT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# cached_result values already looked up in this process, by cache key
+_result_memo = {}
+
+def _open_result_cache():
+    """
+    Opens the result cache database, creating it if needed.
+    """
+    import sqlite3
+    os.makedirs(os.path.dirname(result_cache_file), exist_ok=True)
+    connection = sqlite3.connect(result_cache_file, timeout=10)
+    # a cache can be rebuilt, so skip the fsyncs
+    connection.execute('PRAGMA synchronous = OFF')
+    connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, '
+                       'path TEXT, value TEXT, size INTEGER, last_used REAL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS results_path ON results (path)')
+    return connection
+
+def _read_result(key):
+    """
+    Returns the json text stored under key in the result cache, marking it
+    as used, or None.
+    """
+    import sqlite3
+    import time
+    from contextlib import closing
+    try:
+        with closing(_open_result_cache()) as connection, connection:
+            row = connection.execute('SELECT value FROM results WHERE key = ?',
+                                     (key,)).fetchone()
+            if row is not None:
+                connection.execute('UPDATE results SET last_used = ? WHERE key = ?',
+                                   (time.time(), key))
+                return row[0]
+    except (sqlite3.Error, OSError):
+        pass
+    return None
+
+def _store_result(key, path, value):
+    """
+    Stores the json text value under key in the result cache, then evicts
+    the least recently used results until it fits RESULT_CACHE_MAX_BYTES.
+    """
+    import sqlite3
+    import time
+    from contextlib import closing
+    try:
+        with closing(_open_result_cache()) as connection, connection:
+            connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                               (key, path, value, len(key) + len(path) + len(value),
+                                time.time()))
+            excess = connection.execute('SELECT SUM(size) FROM results').fetchone()[0]
+            excess -= RESULT_CACHE_MAX_BYTES
+            if excess > 0:
+                evicted = []
+                for old_key, size in connection.execute(
+                        'SELECT key, size FROM results ORDER BY last_used'):
+                    if excess <= 0:
+                        break
+                    evicted.append((old_key,))
+                    excess -= size
+                connection.executemany('DELETE FROM results WHERE key = ?', evicted)
+    except (sqlite3.Error, OSError):
+        pass
+
+def invalidate_results(filename):
+    """
+    This function drops every remembered result of a summary file, in this
+    process and in the result cache. Called whenever a summary is written, so
+    a file regenerated with the same size within the same mtime tick is not
+    mistaken for the old one.
+    """
+    import sqlite3
+    from contextlib import closing
+    path = os.path.abspath(filename)
+    _trip_stats_cache.pop(path, None)
+    for key in [key for key in _result_memo if json.loads(key)[2] == path]:
+        del _result_memo[key]
+    if result_cache_file is None or not os.path.exists(result_cache_file):
+        return
+    try:
+        with closing(_open_result_cache()) as connection, connection:
+            connection.execute('DELETE FROM results WHERE path = ?', (path,))
+    except (sqlite3.Error, OSError):
+        pass
+
+def cached_result(version):
+    """
+    Decorator remembering the result of an analysis function of a summary
+    file, function(filename, profile=None), across runs in the result cache.
+    Results are keyed by the function name, version (bump it whenever the
+    function changes what it returns), path, size and modification time of
+    the file, and must be tuples of json values. Hits and misses are counted
+    in profile if given.
+    """
+    def decorate(function):
+        @wraps(function)
+        def cached(filename, profile=None):
+            if result_cache_file is None:
+                return function(filename, profile)
+            file_stat = os.stat(filename)
+            path = os.path.abspath(filename)
+            key = json.dumps([function.__name__, version, path, file_stat.st_size,
+                              file_stat.st_mtime_ns])
+            value = _result_memo.get(key)
+            if value is None:
+                text = _read_result(key)
+                if text is not None:
+                    value = _result_memo[key] = tuple(json.loads(text))
+            if value is not None:
+                if profile is not None:
+                    profile.count('result_cache_hits')
+                return value
+            if profile is not None:
+                profile.count('result_cache_misses')
+            value = function(filename, profile)
+            _result_memo[key] = value
+            _store_result(key, path, json.dumps(value))
+            return value
+        return cached
+    return decorate
+
+@cached_result(version=1)
+def number_of_trips(filename, profile=None):
+    """
+    This function reads in a file with trip data and reports the number of
+    trips made by subscribers, customers, and total overall.
+    """
+    return summarise_trips(filename, profile=profile).trip_counts()
+
+@cached_result(version=1)
+def duration_of_trips(filename, profile=None):
+    """
+    This function reads in a file with trip data and reports the average trip length and 
+    proportion of rides longer than 30 minutes for each city
+    """
+    return summarise_trips(filename, profile=profile).duration_summary()
+
+# Within Chicago, customers have a significantly longer average trip duration of 41.7 minutes compared to subscribers at just 12.5 minutes.                                            ##
+
+@cached_result(version=1)
+def usertype_average(filename, profile=None):
+    """
+    This function reads file and returns trip data of different user types
+    """
+    stats = summarise_trips(filename, profile=profile)
+    return (stats.average_duration('Subscriber'), stats.average_duration('Customer'))
+
+# When set, charts are saved as png files in this directory instead of being
+# shown - used by the command line interface when running headless
+figure_dir = None
+
+# Charts drawn by render_charts are also kept in figure_cache_dir, named after
+# a hash of the aggregates they are drawn from, so a chart whose data has not
+# changed is copied instead of redrawn. At most FIGURE_CACHE_MAX_FILES images
+# are kept, the least recently used removed first. Set figure_cache_dir to
+# None to turn it off, and bump CHART_VERSION whenever draw_chart changes.
+figure_cache_dir = os.path.join(os.path.dirname(result_cache_file), 'figures')
+FIGURE_CACHE_MAX_FILES = 256
+CHART_VERSION = 1
+
+def _pyplot():
+    """
+    Imports matplotlib.pyplot on first use so importing this module stays
+    cheap. Inside IPython charts are shown inline, elsewhere the
+    non-interactive Agg backend is used unless MPLBACKEND says otherwise.
+    """
+    if 'matplotlib.pyplot' not in sys.modules:
+        import matplotlib
+        try:
+            shell = get_ipython()
+        except NameError:
+            shell = None
+        if shell is not None:
+            shell.run_line_magic('matplotlib', 'inline')
+        elif 'MPLBACKEND' not in os.environ:
+            matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def _show_figure(plt, name):
+    """
+    Shows the current chart, or saves it as name.png in figure_dir if set.
+    """
+    if figure_dir is None:
+        plt.show()
+        return
+    os.makedirs(figure_dir, exist_ok=True)
+    plt.savefig(os.path.join(figure_dir, name + '.png'))
+    plt.close()
+
+def _plot_chart(spec):
+    """
+    Draws a chart specification (see draw_chart) on a new pyplot figure and
+    shows or saves it (see _show_figure).
+    """
+    plt = _pyplot()
+    figure, ax = plt.subplots()
+    draw_chart(ax, spec)
+    _show_figure(plt, spec['name'])
+
+def example_chart():
+    """
+    Returns the chart specification of the example histogram of dummy data
+    (taken from the bay area sample).
+    """
+    data = [ 7.65,  8.92,  7.42,  5.50, 16.17,  4.20,  8.98,  9.62, 11.48, 14.33,
+            19.02, 21.53,  3.90,  7.97,  2.62,  2.67,  3.08, 14.40, 12.90,  7.83,
+            25.12,  8.30,  4.93, 12.43, 10.60,  6.17, 10.88,  4.78, 15.15,  3.53,
+             9.43, 13.32, 11.72,  9.85,  5.22, 15.10,  3.95,  3.17,  8.78,  1.88,
+             4.55, 12.68, 12.38,  9.78,  7.63,  6.45, 17.38, 11.90, 11.52,  8.63,]
+    return {'name': 'example-durations', 'kind': 'values', 'values': data,
+            'title': 'Distribution of Trip Durations', 'xlabel': 'Duration (m)'}
+
+def plot_example_histogram():
+    """
+    This function plots an example histogram of dummy data (taken from the
+    bay area sample) to check the plotting libraries work.
+    """
+    _plot_chart(example_chart())
+
+def _histogram_chart(name, histogram, title, **options):
+    """
+    Returns the chart specification of a DurationHistogram.
+    """
+    spec = {'name': name, 'kind': 'histogram', 'edges': histogram.edges,
+            'counts': histogram.counts, 'title': title, 'xlabel': 'Duration (m)'}
+    spec.update(options)
+    return spec
+
+@cached_result(version=1)
+def duration_charts(filename, profile=None):
+    """
+    This function computes the aggregates of the trip duration charts of a
+    summary file: the log-binned histogram of all trip durations and the
+    histograms of subscriber and customer trips under 75 minutes, with the
+    median, p95 and p99 duration of each user type. Returns the three chart
+    specifications (see draw_chart).
+    """
+    # durations range from seconds to days, so use log-spaced bins for all
+    # trips; trips of 75 minutes or more fall into the overflow count of the
+    # user type bins and are left out. Both are filled in one pass.
+    (all_histograms, histograms), sketches = duration_distribution(
+        filename, DurationHistogram.log(1 / 60, 10 ** 5, 50), DurationHistogram.linear(0, 75, 10))
+    charts = [_histogram_chart(_figure_name(filename, 'durations'), all_histograms[ALL_USERS],
+                               'Distribution of Trip Durations', xscale='log')]
+    empty = DurationHistogram.linear(0, 75, 10)
+    for user_type, chart in (('Subscriber', 'subscriber-durations'),
+                             ('Customer', 'customer-durations')):
+        quantiles = None
+        if user_type in sketches:
+            sketch = sketches[user_type]
+            quantiles = [sketch.quantile(0.5), sketch.quantile(0.95), sketch.quantile(0.99)]
+        charts.append(_histogram_chart(
+            _figure_name(filename, chart), histograms.get(user_type, empty),
+            'Distribution of Trip Durations for {}s'.format(user_type),
+            rwidth=1, user_type=user_type, quantiles=quantiles))
+    return tuple(charts)
+
+def _print_quantiles(charts):
+    """
+    Prints the median, p95 and p99 duration of every chart specification
+    that has them.
+    """
+    for spec in charts:
+        if spec.get('quantiles'):
+            print('{}: median {:.1f}, p95 {:.1f}, p99 {:.1f} minutes'.format(
+                spec['user_type'], *spec['quantiles']))
+
+def plot_all_durations(filename):
+    """
+    This function reads file and plots all trip times on histogram
+    """
+    _plot_chart(duration_charts(filename)[0])
+    return    
+
+def _figure_name(filename, chart):
+    """
+    Returns the name a chart of a summary file is saved under, e.g.
+    'NYC-durations'.
+    """
+    return '{}-{}'.format(os.path.basename(filename).split('-')[0], chart)
+
+def plot_all(filename):
+    """
+    This function reads file and plots all trip times on histogram
+    """
+    charts = duration_charts(filename)[1:]
+    for spec in charts:
+        _plot_chart(spec)
+    # the quantiles come from the same pass over the file
+    _print_quantiles(charts)
+    return    
+
+# One question that was explored was how usage during rush hours (set as 07:00 to 09:00 and 17:00 to 20:00) changed during weekdays versus weekends for both subscribers and customers in NYC. 
+# The aim of this was show how usage habits changed for both usertypes at different stages of the week.
+# 
+# The results are show below 
+# Subscribers: *57.3%* of weekday trips and *50.7%* of weekend trips were during rush hours respectively 
+# Customers: *29.59%* of weekday trips and *30.52%* of weekend trips were during rush hours respectively 
+# It is highly likely that subscribers use bike sharing for commuting to work far more than customers who appear to use bikes more consistently through out the day. 
+# Furthermore subscriber habits change more notably during weekends with a drop of usage during rushour of 6.6% compared to a slight rise of 0.93% for customers. 
+# Considering that most users are subscribers, a potential action point from this analysis is to ensure increased availablity during rushhours on weekdays. 
+# Also consider using a marketing strategy that emphasises *leisure* use for non-commuting activity to attract new customers while targeting exisitng customers with *commuting* advantages offered by bike sharing to convert them into subscribers.
+
+@cached_result(version=1)
+def rush_hour_counts(filename, profile=None):
+    """
+    This function counts subscriber and customer trips on weekdays and weekends,
+    in total and during rush hours (07:00 to 09:00 and 17:00 to 20:00). Note
+    that, as in the original analysis, only Monday is counted as a weekday.
+    """
+    return summarise_trips(filename, profile=profile).rush_hour_counts()
+
+def rush_hour_percentages(filename, profile=None):
+    """
+    This function returns the percentage of subscriber weekday, subscriber
+    weekend, customer weekday and customer weekend trips made during rush
+    hours, rounded to two decimal places.
+    """
+    (sub_weekday_rush_count, sub_weekday_total_count,
+     sub_weekend_rush_count, sub_weekend_total_count,
+     cus_weekday_rush_count, cus_weekday_total_count,
+     cus_weekend_rush_count, cus_weekend_total_count) = rush_hour_counts(filename, profile)
+    sub_weekday_output = (sub_weekday_rush_count / sub_weekday_total_count) * 100
+    sub_weekend_output = (sub_weekend_rush_count / sub_weekend_total_count) * 100     
+    cus_weekday_output = (cus_weekday_rush_count / cus_weekday_total_count) * 100
+    cus_weekend_output = (cus_weekend_rush_count / cus_weekend_total_count) * 100    
+    sub_weekday_output = round(sub_weekday_output, 2)
+    sub_weekend_output = round(sub_weekend_output, 2)
+    cus_weekday_output = round(cus_weekday_output, 2)
+    cus_weekend_output = round(cus_weekend_output, 2)
+    return (sub_weekday_output, sub_weekend_output, cus_weekday_output, cus_weekend_output)
+
+def print_rush_hour_percentages(filename):
+    """
+    This function prints the rush hour percentages of rush_hour_percentages.
+    """
+    (sub_weekday_output, sub_weekend_output,
+     cus_weekday_output, cus_weekend_output) = rush_hour_percentages(filename)
+    print('For subscribers, {}% of weekday trips and {}% of weekend trips were during rush hours respectively'.format(sub_weekday_output, sub_weekend_output))
+    print('For customers, {}% of weekday trips and {}% of weekend trips were during rush hours respectively'.format(cus_weekday_output, cus_weekend_output))
+
+def rush_hour_chart(filename, profile=None):
+    """
+    This function returns the chart specification (see draw_chart) of the
+    rush hour usage chart of a summary file, from rush_hour_percentages.
+    """
+    (sub_weekday_output, sub_weekend_output,
+     cus_weekday_output, cus_weekend_output) = rush_hour_percentages(filename, profile)
+    return {'name': _figure_name(filename, 'rush-hours'), 'kind': 'rush_hours',
+            'weekday': [sub_weekday_output, cus_weekday_output],
+            'weekend': [sub_weekend_output, cus_weekend_output],
+            'title': '{} Rush Hour Usage Weekday vs Weekends'.format(
+                os.path.basename(filename).split('-')[0])}
+
+def plot_analysis(filename, profile=None):
+    """
+    This function plots the proportion of usgae in work hours vs non work hours for on weekdays and weekend for
+    subscribers and customers
+    """
+    plt = _pyplot()
+    spec = rush_hour_chart(filename, profile)
+    # create plot
+    fig, ax = plt.subplots()
+    draw_chart(ax, spec)
+    with _timed(profile, 'render'):
+        _show_figure(plt, spec['name'])
+    print_rush_hour_percentages(filename)
+    return
+
+def draw_chart(ax, spec):
+    """
+    This function draws a chart specification on the matplotlib axes ax.
+    Specifications are json dictionaries of everything a chart shows, the
+    name it is saved under and its kind: 'values' (a histogram of raw
+    values), 'histogram' (the edges and counts of a DurationHistogram) or
+    'rush_hours' (the rush hour percentages of subscribers and customers).
+    """
+    import numpy as np
+    if spec['kind'] == 'values':
+        ax.hist(spec['values'])
+    elif spec['kind'] == 'histogram':
+        histogram = DurationHistogram(spec['edges'])
+        histogram.counts = list(spec['counts'])
+        histogram.plot(ax=ax, rwidth=spec.get('rwidth'))
+        if spec.get('xscale'):
+            ax.set_xscale(spec['xscale'])
+    elif spec['kind'] == 'rush_hours':
+        # data to plot
+        n_groups = 2
+        index = np.arange(n_groups)
+        bar_width = 0.35
+        opacity = 0.8
+        ax.bar(index, spec['weekday'], bar_width, alpha=opacity, color='b',
+               label='% of rush hours trips on weekdays')
+        ax.bar(index + bar_width, spec['weekend'], bar_width, alpha=opacity, color='g',
+               label='% of rush hours trips on weekends')
+        ax.set_xlabel('User Type')
+        ax.set_ylabel('% of trips in rush hours')
+        ax.set_xticks(index + (0.5 * bar_width))
+        ax.set_xticklabels(('Subscribers', 'Customers'))
+        ax.legend()
+    else:
+        raise ValueError('unknown chart kind {!r}'.format(spec['kind']))
+    ax.set_title(spec['title'])
+    if 'xlabel' in spec:
+        ax.set_xlabel(spec['xlabel'])
+    if spec['kind'] == 'rush_hours':
+        ax.figure.tight_layout()
+
+def chart_key(spec):
+    """
+    Returns the hash a chart is cached under in figure_cache_dir: of its
+    specification, CHART_VERSION and the matplotlib version.
+    """
+    import hashlib
+    import matplotlib
+    text = json.dumps([CHART_VERSION, matplotlib.__version__, spec], sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def render_chart(task):
+    """
+    Worker for render_charts. Takes as input a tuple of a chart
+    specification, the png file to save it to and the file to keep a copy of
+    it in (None for no copy) and draws it on a matplotlib Figure of its own,
+    so no pyplot backend is involved.
+    """
+    import shutil
+    from matplotlib.figure import Figure
+    spec, png_file, cache_file = task
+    figure = Figure()
+    draw_chart(figure.add_subplot(), spec)
+    figure.savefig(png_file)
+    if cache_file is not None:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        shutil.copyfile(png_file, temp_file)
+        os.replace(temp_file, cache_file)
+
+def _trim_figure_cache():
+    """
+    Removes the least recently used images from figure_cache_dir until at
+    most FIGURE_CACHE_MAX_FILES are left.
+    """
+    try:
+        names = [name for name in os.listdir(figure_cache_dir) if name.endswith('.png')]
+        if len(names) <= FIGURE_CACHE_MAX_FILES:
+            return
+        paths = sorted((os.path.join(figure_cache_dir, name) for name in names),
+                       key=os.path.getmtime)
+        for path in paths[:len(paths) - FIGURE_CACHE_MAX_FILES]:
+            os.remove(path)
+    except OSError:
+        pass
+
+def render_charts(charts, output_dir=None, processes=None):
+    """
+    This function saves chart specifications (see draw_chart) as png files
+    in output_dir (by default figure_dir, or ./figures) without any
+    interactive backend. A chart already in figure_cache_dir under the same
+    chart_key is copied from there, the others are drawn in parallel by a
+    pool of worker processes (None for one per core, at most one per chart)
+    or in this process if only one is needed. Returns the number of charts
+    drawn and the number copied from the cache.
+    """
+    import shutil
+    if output_dir is None:
+        output_dir = figure_dir or './figures'
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = []
+    copied = 0
+    for spec in charts:
+        png_file = os.path.join(output_dir, spec['name'] + '.png')
+        cache_file = None
+        if figure_cache_dir is not None:
+            cache_file = os.path.join(figure_cache_dir, chart_key(spec) + '.png')
+            if os.path.exists(cache_file):
+                shutil.copyfile(cache_file, png_file)
+                # mark it as recently used
+                os.utime(cache_file)
+                copied += 1
+                continue
+        tasks.append((spec, png_file, cache_file))
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(tasks))
+    if processes <= 1:
+        for task in tasks:
+            render_chart(task)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context
+        with ProcessPoolExecutor(processes, mp_context=get_context('spawn')) as pool:
+            for _ in pool.map(render_chart, tasks):
+                pass
+    if figure_cache_dir is not None and tasks:
+        _trim_figure_cache()
+    return (len(tasks), copied)
+
+def city_charts(city_file):
+    """
+    Returns the chart specifications of every summary file in city_file:
+    the trip duration charts and the rush hour chart of each city.
+    """
+    charts = []
+    for city, filename in city_file.items():
+        charts.extend(duration_charts(filename))
+        charts.append(rush_hour_chart(filename))
+    return charts
+
+## Live Trip Feeds
+
+# Sliding windows kept by LiveTripMetrics: the name of each window, the length
+# of its buckets in seconds and the number of buckets. Buckets line up with
+# whole minutes, hours and days of the trip start times, so 'today' is the
+# calendar day of the latest trip
+LIVE_WINDOWS = (('last_hour', 60, 60),
+                ('today', 86400, 1),
+                ('last_7_days', 3600, 7 * 24))
+# Seconds between checks for new lines when following a file
+LIVE_POLL_INTERVAL = 0.5
+
+class SlidingWindowStats:
+    """
+    TripStats of the trips started in the last n_buckets buckets of
+    bucket_seconds each. Every bucket keeps its own TripStats and the window
+    keeps their running total, so adding a trip costs two TripStats.add calls
+    and a bucket leaving the window is subtracted once, whatever the number
+    of trips in the window. Trips older than the window are counted as late
+    and left out.
+    """
+
+    def __init__(self, bucket_seconds, n_buckets):
+        self.bucket_seconds = bucket_seconds
+        self.n_buckets = n_buckets
+        self.buckets = [None] * n_buckets
+        self.totals = TripStats()
+        # index of the newest bucket, in bucket_seconds since year 1
+        self.head = None
+        self.late = 0
+
+    def advance(self, seconds):
+        """
+        Moves the window forward to end at the bucket holding seconds,
+        dropping the buckets that fall out of it.
+        """
+        index = seconds // self.bucket_seconds
+        if self.head is not None and index <= self.head:
+            return
+        if self.head is None or index - self.head >= self.n_buckets:
+            self.buckets = [None] * self.n_buckets
+            self.totals = TripStats()
+        else:
+            for expired in range(self.head + 1, index + 1):
+                slot = expired % self.n_buckets
+                if self.buckets[slot] is not None:
+                    self.totals.subtract(self.buckets[slot])
+                    self.buckets[slot] = None
+        self.head = index
+
+    def add(self, seconds, duration, hour, day_of_week, user_type):
+        """
+        Adds a trip started at seconds (see LiveTripMetrics), returning False
+        if it is too old for the window.
+        """
+        index = seconds // self.bucket_seconds
+        if self.head is None or index > self.head:
+            self.advance(seconds)
+        elif index <= self.head - self.n_buckets:
+            self.late += 1
+            return False
+        slot = index % self.n_buckets
+        bucket = self.buckets[slot]
+        if bucket is None:
+            bucket = self.buckets[slot] = TripStats()
+        bucket.add(duration, hour, day_of_week, user_type)
+        self.totals.add(duration, hour, day_of_week, user_type)
+        return True
+
+def _window_summary(stats):
+    """
+    Returns the plot_analysis and trip statistics of a window's TripStats
+    as a json dictionary, with None for anything without trips.
+    """
+    def percentage(part, whole):
+        return round(part / whole * 100, 2) if whole else None
+    summary = {'trips': stats.n_trips,
+               'average_duration': (round(stats.total_minutes / stats.n_trips, 1)
+                                    if stats.n_trips else None),
+               'over_30_percent': percentage(stats.n_over30, stats.n_trips)}
+    (sub_weekday_rush, sub_weekday_total, sub_weekend_rush, sub_weekend_total,
+     cus_weekday_rush, cus_weekday_total, cus_weekend_rush, cus_weekend_total) = stats.rush_hour_counts()
+    rush = {'Subscriber': ((sub_weekday_rush, sub_weekday_total),
+                           (sub_weekend_rush, sub_weekend_total)),
+            'Customer': ((cus_weekday_rush, cus_weekday_total),
+                         (cus_weekend_rush, cus_weekend_total))}
+    for user_type, (weekday, weekend) in rush.items():
+        count = stats.user_counts.get(user_type, 0)
+        summary[user_type] = {
+            'trips': count,
+            'average_duration': (round(stats.user_minutes[user_type] / count, 1)
+                                 if count else None),
+            'weekday_rush_percent': percentage(*weekday),
+            'weekend_rush_percent': percentage(*weekend)}
+    return summary
+
+@lru_cache(maxsize=START_TIME_CACHE_SIZE)
+def _start_date_ordinal(date):
+    """
+    Returns the proleptic ordinal (as datetime.toordinal) of an 'm/d/YYYY'
+    date, memoized as every trip of a day shares it.
+    """
+    month, day, year = date.split('/')
+    return datetime(int(year), int(month), int(day)).toordinal()
+
+def _datetime_seconds(moment):
+    """
+    Returns a datetime as seconds since the start of year 1, the time scale
+    of the live windows.
+    """
+    return (moment.toordinal() * 86400 + moment.hour * 3600
+            + moment.minute * 60 + moment.second)
+
+def start_time_seconds(dateandtime, datetime_format):
+    """
+    Takes as input a raw start time string and its format and returns the
+    month, hour and day of the week, as parse_start_time does, and the start
+    time in seconds since the start of year 1. In the city formats the date
+    and hour go through the memoized parse_start_time and only the minutes
+    and seconds are read per trip. Other formats are parsed once with
+    strptime.
+    """
+    if datetime_format.startswith('%m/%d/%Y %H:'):
+        month, hour, day_of_week = parse_start_time(dateandtime, datetime_format)
+        date, sep, rest = dateandtime.rpartition(' ')
+        fields = rest.split(':')[1:]
+        if all(_is_minute_field(field) for field in fields):
+            seconds = _start_date_ordinal(date) * 86400 + hour * 3600 + int(fields[0]) * 60
+            if len(fields) == 2:
+                seconds += int(fields[1])
+            return (month, hour, day_of_week, seconds)
+    start = datetime.strptime(dateandtime, datetime_format)
+    return (start.month, start.hour, calendar.day_name[start.weekday()],
+            _datetime_seconds(start))
+
+class LiveTripMetrics:
+    """
+    Trip statistics of a live feed of raw trips of one city over the sliding
+    windows of LIVE_WINDOWS: the trip counts, average durations and the rush
+    hour percentages of plot_analysis (only Monday counted as a weekday, as
+    in the original analysis) by user type. Rows are parsed with
+    duration_in_mins, type_of_user and start_time_seconds (time_of_trip plus
+    the start time in seconds) and windows follow the trip start times, or
+    the clock when snapshot is given the time. Feed it lines of csv text,
+    header first, with ingest (from tail_trip_file, serve_trip_socket or
+    anything else) and read the current values at any time, from any thread,
+    with snapshot.
+    """
+
+    def __init__(self, city, windows=LIVE_WINDOWS):
+        self.city = city
+        self.windows = {name: SlidingWindowStats(bucket_seconds, n_buckets)
+                        for name, bucket_seconds, n_buckets in windows}
+        self.events = 0
+        self.malformed = 0
+        # latest trip start time, in seconds (see start_time_seconds)
+        self.latest = None
+        self._lock = threading.Lock()
+
+    def add_trip(self, datum):
+        """
+        Adds a single raw trip, a dictionary of the fields of a row by column
+        name. Returns False, counting it as malformed, if it cannot be parsed.
+        """
+        schema = CITY_SCHEMAS[self.city]
+        try:
+            duration = duration_in_mins(datum, self.city)
+            month, hour, day_of_week, seconds = start_time_seconds(
+                datum[schema['start_time']], schema['start_time_format'])
+            user_type = type_of_user(datum, self.city)
+        except (ValueError, KeyError, TypeError):
+            with self._lock:
+                self.malformed += 1
+            return False
+        with self._lock:
+            self.events += 1
+            if self.latest is None or seconds > self.latest:
+                self.latest = seconds
+            for window in self.windows.values():
+                window.add(seconds, duration, hour, day_of_week, user_type)
+        return True
+
+    def ingest(self, lines):
+        """
+        Adds the trips of an iterable of csv lines whose first line is the
+        header row, as they arrive. Returns when lines is exhausted.
+        """
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        if header is None:
+            return
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != len(header):
+                with self._lock:
+                    self.malformed += 1
+                continue
+            self.add_trip(dict(zip(header, row)))
+
+    def snapshot(self, window=None, now=None):
+        """
+        Returns the current statistics of every window (or just the named
+        window) as a json dictionary. The windows end at the latest trip
+        start time unless now, a datetime, is later - pass the current time
+        so the windows keep moving while the feed is quiet.
+        """
+        from datetime import timedelta
+        with self._lock:
+            latest = self.latest
+            if now is not None and (latest is None or _datetime_seconds(now) > latest):
+                latest = _datetime_seconds(now)
+            if latest is not None:
+                for stats in self.windows.values():
+                    stats.advance(latest)
+                as_of = datetime.fromordinal(latest // 86400) + timedelta(seconds=latest % 86400)
+            names = [window] if window is not None else list(self.windows)
+            result = {'city': self.city,
+                      'as_of': as_of.isoformat() if latest is not None else None,
+                      'events': self.events,
+                      'malformed_rows': self.malformed,
+                      'windows': {name: _window_summary(self.windows[name].totals)
+                                  for name in names}}
+            for name in names:
+                result['windows'][name]['late_trips'] = self.windows[name].late
+        return result
+
+def _ends_with_newline(filename, position):
+    """
+    Returns True if the byte of filename just before position is a newline,
+    or position is 0.
+    """
+    if position == 0:
+        return True
+    with open(filename, 'rb') as f_in:
+        f_in.seek(position - 1)
+        return f_in.read(1) == b'\n'
+
+def tail_trip_file(filename, stop=None, from_start=True, poll_interval=None):
+    """
+    This function yields the lines of a raw trip file as they are appended,
+    like tail -f, starting with its header row. Unless from_start is set the
+    rows already in the file are skipped, along with the rest of a row being
+    written at that moment. A line is only yielded once its newline has been
+    written. If the file is truncated or replaced it is
+    read again from the top. Stops when stop, a threading.Event, is set.
+    """
+    if poll_interval is None:
+        poll_interval = LIVE_POLL_INTERVAL
+    if stop is None:
+        stop = threading.Event()
+    f_in = open(filename, newline='')
+    try:
+        header = None
+        partial = ''
+        # the end of a row that was being written when the file was opened
+        skip_fragment = False
+        while not stop.is_set():
+            line = f_in.readline()
+            if line.endswith('\n'):
+                line = partial + line
+                partial = ''
+                if skip_fragment:
+                    skip_fragment = False
+                    continue
+                if header is None:
+                    header = line
+                    if not from_start:
+                        f_in.seek(0, 2)
+                        skip_fragment = not _ends_with_newline(filename, f_in.tell())
+                yield line
+                continue
+            partial += line
+            # replaced or truncated: start over, skipping the header
+            try:
+                replaced = (os.stat(filename).st_ino != os.fstat(f_in.fileno()).st_ino
+                            or os.path.getsize(filename) < f_in.tell())
+            except OSError:
+                replaced = False
+            if replaced and header is not None:
+                f_in.close()
+                f_in = open(filename, newline='')
+                # the header has been yielded already
+                f_in.readline()
+                partial = ''
+                continue
+            stop.wait(poll_interval)
+    finally:
+        f_in.close()
+
+def serve_trip_socket(metrics, address):
+    """
+    This function starts a server feeding the trips sent to a local socket
+    into metrics, a LiveTripMetrics, and returns it with its thread running.
+    address is a (host, port) pair for TCP or a path for a unix socket. Each
+    connection sends csv lines, header first. Stop it with shutdown().
+    """
+    import socketserver
+
+    class TripHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            metrics.ingest(io.TextIOWrapper(self.rfile, encoding='utf-8', newline=''))
+
+    if isinstance(address, str):
+        server = socketserver.ThreadingUnixStreamServer(address, TripHandler)
+    else:
+        server = socketserver.ThreadingTCPServer(address, TripHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run_live(city, follow=None, listen=None, interval=10.0, from_start=False,
+             stop=None, wall_clock=True):
+    """
+    This function keeps LiveTripMetrics of a city on the trips appended to
+    the file follow (including those already in it if from_start is set) or
+    sent to the socket address listen (see serve_trip_socket) and prints a
+    json snapshot every interval seconds until interrupted or stop, a
+    threading.Event, is set. The windows end at the current local time, so
+    trips age out while the feed is quiet, unless wall_clock is False (for
+    replaying old files), when they end at the latest trip.
+    """
+    metrics = LiveTripMetrics(city)
+    if stop is None:
+        stop = threading.Event()
+    server = None
+    if follow is not None:
+        threading.Thread(target=metrics.ingest,
+                         args=(tail_trip_file(follow, stop, from_start),),
+                         daemon=True).start()
+    if listen is not None:
+        server = serve_trip_socket(metrics, listen)
+    try:
+        while not stop.wait(interval):
+            now = datetime.now() if wall_clock else None
+            print(json.dumps(metrics.snapshot(now=now)), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            if isinstance(listen, str):
+                os.remove(listen)
+    return metrics
+
+## Synthetic Data and Benchmarks
+
+# Raw file layout used by generate_trips: the header and first trip of each
+# 2016 data file (the trip checked by check_city_parsers), the stop time and
+# station id columns and the raw user types with their share of trips
+SYNTHETIC_TRIPS = {'NYC': {'header': ['tripduration', 'starttime', 'stoptime',
+                                      'start station id', 'start station name',
+                                      'start station latitude', 'start station longitude',
+                                      'end station id', 'end station name',
+                                      'end station latitude', 'end station longitude',
+                                      'bikeid', 'usertype', 'birth year', 'gender'],
+                           'first_trip': ['839', '1/1/2016 00:09:55', '1/1/2016 00:23:54',
+                                          '532', 'S 5 Pl & S 4 St', '40.710451', '-73.960876',
+                                          '401', 'Allen St & Rivington St', '40.72019576',
+                                          '-73.98997825', '17109', 'Customer', '', '0'],
+                           'stop_time': 'stoptime',
+                           'stations': ('start station id', 'end station id'),
+                           'user_types': (('Subscriber', 0.89), ('Customer', 0.11))},
+                   'Chicago': {'header': ['trip_id', 'starttime', 'stoptime', 'bikeid',
+                                          'tripduration', 'from_station_id',
+                                          'from_station_name', 'to_station_id',
+                                          'to_station_name', 'usertype', 'gender',
+                                          'birthyear'],
+                               'first_trip': ['9080545', '3/31/2016 23:30', '3/31/2016 23:46',
+                                              '2295', '926', '156', 'Clark St & Wellington Ave',
+                                              '166', 'Ashland Ave & Wrightwood Ave',
+                                              'Subscriber', 'Male', '1990'],
+                               'stop_time': 'stoptime',
+                               'stations': ('from_station_id', 'to_station_id'),
+                               'user_types': (('Subscriber', 0.77), ('Customer', 0.23))},
+                   'Washington': {'header': ['Duration (ms)', 'Start date', 'End date',
+                                             'Start station number', 'Start station',
+                                             'End station number', 'End station',
+                                             'Bike number', 'Member Type'],
+                                  'first_trip': ['427387', '3/31/2016 22:57', '3/31/2016 23:04',
+                                                 '31602', 'Park Rd & Holmead Pl NW', '31207',
+                                                 'Georgia Ave and Fairmont St NW', 'W20842',
+                                                 'Registered'],
+                                  'stop_time': 'End date',
+                                  'stations': ('Start station number', 'End station number'),
+                                  'user_types': (('Registered', 0.8), ('Casual', 0.2))}}
+
+# Relative number of trips started in each hour of the day, peaking in the
+# morning and evening commutes
+SYNTHETIC_HOUR_WEIGHTS = [2, 1, 1, 1, 1, 2, 4, 9, 14, 9, 6, 7,
+                          8, 8, 8, 9, 11, 15, 13, 9, 6, 5, 4, 3]
+# Mean and spread of the log of the trip duration in seconds by standard user
+# type - roughly 11 minutes for subscribers and 25 for customers
+SYNTHETIC_DURATIONS = {'Subscriber': (6.5, 0.6), 'Customer': (7.3, 0.7)}
+SYNTHETIC_STATIONS = 600
+
+def _synthetic_timestamp(days, seconds, with_seconds):
+    """
+    Formats a time of day (seconds) on the 2016 day days[i] in the raw
+    Motivate style: month and day without leading zeros.
+    """
+    day, seconds = divmod(seconds, 86400)
+    month, day_of_month, year = days[day]
+    hour, seconds = divmod(seconds, 3600)
+    minute, second = divmod(seconds, 60)
+    if with_seconds:
+        return '{}/{}/{} {:02d}:{:02d}:{:02d}'.format(month, day_of_month, year,
+                                                    hour, minute, second)
+    return '{}/{}/{} {:02d}:{:02d}'.format(month, day_of_month, year, hour, minute)
+
+def generate_trips(filename, city, n_rows, seed=2016):
+    """
+    This function writes n_rows synthetic 2016 trips of a city to filename
+    (compressed if it ends in .gz, .bz2 or .xz) in the exact layout and
+    timestamp format of its raw data file, starting with
+    the real first trip so check_city_parsers passes. The same seed always
+    gives the same file. Start times are spread over the year with commute
+    peaks and durations are log-normal by user type.
+    """
+    from datetime import timedelta
+    from itertools import accumulate
+    from random import Random
+    synthetic = SYNTHETIC_TRIPS[city]
+    schema = CITY_SCHEMAS[city]
+    header = synthetic['header']
+    duration_column = header.index(schema['duration'])
+    start_column = header.index(schema['start_time'])
+    stop_column = header.index(synthetic['stop_time'])
+    user_column = header.index(schema['user_type'])
+    station_columns = [header.index(column) for column in synthetic['stations']]
+    with_seconds = schema['start_time_format'].endswith('%S')
+    divisor = schema['duration_divisor']
+    raw_user_types = [user_type for user_type, share in synthetic['user_types']]
+    user_type_weights = list(accumulate(share for user_type, share
+                                        in synthetic['user_types']))
+    durations = [SYNTHETIC_DURATIONS[schema['user_types'].get(user_type, user_type)]
+                 for user_type in raw_user_types]
+    # month, day and year of every day trips can start or end on
+    days = []
+    for day in range(366 + 7):
+        date = datetime(2016, 1, 1) + timedelta(days=day)
+        days.append((date.month, date.day, date.year))
+    hours = list(range(24))
+    hour_weights = list(accumulate(SYNTHETIC_HOUR_WEIGHTS))
+    random = Random('{}-{}'.format(seed, city))
+    # the trip_id column of Chicago counts up from the first trip
+    trip_id = int(synthetic['first_trip'][0]) if header[0] == 'trip_id' else None
+    with open_trip_file(filename, 'w', newline='') as f_out:
+        trip_writer = csv.writer(f_out)
+        trip_writer.writerow(header)
+        trip_writer.writerow(synthetic['first_trip'])
+        row = list(synthetic['first_trip'])
+        for i in range(n_rows - 1):
+            user = random.choices(range(len(raw_user_types)),
+                                  cum_weights=user_type_weights)[0]
+            mu, sigma = durations[user]
+            duration = 60 + random.lognormvariate(mu, sigma)
+            seconds = int(duration)
+            hour = random.choices(hours, cum_weights=hour_weights)[0]
+            start = random.randrange(366) * 86400 + hour * 3600 + random.randrange(3600)
+            if not with_seconds:
+                start -= start % 60
+            row[duration_column] = str(int(duration * divisor / 60))
+            row[start_column] = _synthetic_timestamp(days, start, with_seconds)
+            row[stop_column] = _synthetic_timestamp(days, start + seconds, with_seconds)
+            row[user_column] = raw_user_types[user]
+            for column in station_columns:
+                row[column] = str(random.randrange(1, SYNTHETIC_STATIONS + 1))
+            if trip_id is not None:
+                row[0] = str(trip_id + i + 1)
+            trip_writer.writerow(row)
+
+def generate_city_files(city_info, n_rows, seed=2016):
+    """
+    This function writes n_rows synthetic trips to the input file of every
+    city in city_info, see generate_trips.
+    """
+    for city, filenames in city_info.items():
+        os.makedirs(os.path.dirname(filenames['in_file']) or '.', exist_ok=True)
+        generate_trips(filenames['in_file'], city, n_rows, seed)
+        print('{}: wrote {:,} trips to {}'.format(city, n_rows, filenames['in_file']))
+
+# Stages timed by benchmark_suite, each run in a fresh process
+BENCHMARK_STAGES = ['condense_data', 'number_of_trips', 'duration_of_trips',
+                    'usertype_average', 'plot_analysis']
+# Default file the benchmark baseline is saved in and read from
+BENCHMARK_BASELINE = './benchmarks/baseline.json'
+# Allowed fractional drop in rows/sec (or rise in peak RSS) before a stage
+# counts as a regression
+BENCHMARK_TOLERANCE = 0.2
+
+def _peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MiB, or None where
+    the resource module is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def _benchmark_stage(task):
+    """
+    Worker for benchmark_suite. Takes as input a tuple of the stage name,
+    city, raw input file, summary file and chart directory, runs the stage
+    with its output discarded and returns the wall time and peak RSS.
+    """
+    from contextlib import redirect_stdout
+    from timeit import default_timer as timer
+    global figure_dir, result_cache_file
+    stage, city, in_file, out_file, chart_dir = task
+    figure_dir = chart_dir
+    # time the work, not the result cache
+    result_cache_file = None
+    if stage == 'plot_analysis':
+        # import matplotlib before timing, as the notebook has it loaded
+        _pyplot()
+    with redirect_stdout(io.StringIO()):
+        start = timer()
+        if stage == 'condense_data':
+            condense_data(in_file, out_file, city)
+        else:
+            globals()[stage](out_file)
+        wall_time = timer() - start
+    return (wall_time, _peak_rss_mb())
+
+def benchmark_suite(city_info, stages=BENCHMARK_STAGES):
+    """
+    This function times every stage in stages on every city in city_info, each
+    in a fresh process so the peak memory and the caches belong to that stage
+    alone. Nothing in the data directory is written: the condense_data stage
+    writes its summary to a temporary directory and the later stages read it
+    from there. Returns a dictionary keyed by 'city:stage' holding the rows,
+    wall time, rows per second and peak RSS (MiB) of each.
+    """
+    import multiprocessing
+    import tempfile
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    with tempfile.TemporaryDirectory() as chart_dir:
+        for city, filenames in city_info.items():
+            out_file = filenames['out_file']
+            if 'condense_data' in stages:
+                out_file = os.path.join(chart_dir, os.path.basename(out_file))
+            n_rows = None
+            for stage in stages:
+                with context.Pool(1) as pool:
+                    wall_time, peak_rss = pool.apply(_benchmark_stage, [(
+                        stage, city, filenames['in_file'], out_file, chart_dir)])
+                if n_rows is None:
+                    # every stage handles one row per trip
+                    with open_trip_file(out_file, 'rb') as f_in:
+                        n_rows = sum(1 for line in f_in) - 1
+                results['{}:{}'.format(city, stage)] = {
+                    'rows': n_rows, 'wall_time': wall_time,
+                    'rows_per_sec': n_rows / wall_time, 'peak_rss_mb': peak_rss}
+    return results
+
+def print_benchmark_results(results):
+    """
+    This function prints the results of benchmark_suite as a table.
+    """
+    print('{:<30} {:>12} {:>10} {:>14} {:>10}'.format(
+        'stage', 'rows', 'seconds', 'rows/sec', 'peak MiB'))
+    for name, result in results.items():
+        peak_rss = result['peak_rss_mb']
+        print('{:<30} {:>12,} {:>10.2f} {:>14,.0f} {:>10}'.format(
+            name, result['rows'], result['wall_time'], result['rows_per_sec'],
+            '-' if peak_rss is None else '{:.0f}'.format(peak_rss)))
+
+def save_benchmark_baseline(results, baseline_file=BENCHMARK_BASELINE):
+    """
+    This function stores the results of benchmark_suite as the baseline to
+    compare later runs against.
+    """
+    os.makedirs(os.path.dirname(baseline_file) or '.', exist_ok=True)
+    with open(baseline_file, 'w') as f_out:
+        json.dump(results, f_out, indent=2, sort_keys=True)
+
+def benchmark_regressions(results, baseline_file=BENCHMARK_BASELINE,
+                          tolerance=BENCHMARK_TOLERANCE):
+    """
+    This function compares the results of benchmark_suite with the stored
+    baseline and returns a message for every stage whose rows per second
+    fell, or whose peak RSS rose, by more than tolerance. Stages missing from
+    the baseline are not checked.
+    """
+    with open(baseline_file) as f_in:
+        baseline = json.load(f_in)
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if result['rows_per_sec'] < before['rows_per_sec'] * (1 - tolerance):
+            regressions.append('{}: {:,.0f} rows/sec, baseline {:,.0f}'.format(
+                name, result['rows_per_sec'], before['rows_per_sec']))
+        if (result['peak_rss_mb'] is not None and before['peak_rss_mb'] is not None
+                and result['peak_rss_mb'] > before['peak_rss_mb'] * (1 + tolerance)):
+            regressions.append('{}: peak RSS {:.0f} MiB, baseline {:.0f} MiB'.format(
+                name, result['peak_rss_mb'], before['peak_rss_mb']))
+    return regressions
+
+## Report
+
+def check_city_parsers(data_files):
+    """
+    This function prints the first trip of each raw data file and checks
+    that duration_in_mins, time_of_trip and type_of_user parse the first trips
+    of the 2016 data files correctly. There should be no output other than
+    the trips if all of the assertions pass.
+    """
+    # print the first trip from each file, store in dictionary
+    example_trips = {}
+    for data_file in data_files:
+        city, first_trip = print_first_point(data_file)
+        example_trips[city] = first_trip
+    tests = {'NYC': 13.9833,
+             'Chicago': 15.4333,
+             'Washington': 7.1231}
+    for city in tests.keys() & example_trips.keys():
+        assert abs(duration_in_mins(example_trips[city], city) - tests[city]) < .001
+    tests = {'NYC': (1, 0, 'Friday'),
+             'Chicago': (3, 23, 'Thursday'),
+             'Washington': (3, 22, 'Thursday')}
+    for city in tests.keys() & example_trips.keys():
+        assert time_of_trip(example_trips[city], city) == tests[city]
+    tests = {'NYC': 'Customer',
+             'Chicago': 'Subscriber',
+             'Washington': 'Subscriber'}
+    for city in tests.keys() & example_trips.keys():
+        assert type_of_user(example_trips[city], city) == tests[city]
+
+def _synthetic_summary(tmp_dir, city, n_rows):
+    """
+    Writes n_rows synthetic trips of a city (see generate_trips) to raw.csv
+    in tmp_dir and their summary, condensed serially, to serial.csv. Returns
+    both paths.
+    """
+    raw_file = os.path.join(tmp_dir, 'raw.csv')
+    serial_file = os.path.join(tmp_dir, 'serial.csv')
+    generate_trips(raw_file, city, n_rows)
+    condense_data(raw_file, serial_file, city)
+    return (raw_file, serial_file)
+
+def check_incremental_condense(city='NYC', n_rows=20000, processes=2):
+    """
+    This function checks incremental condensing on n_rows synthetic trips of
+    a city, in a temporary directory: a run over a file cut mid-line and then
+    completed, and a file whose last line never gets a newline (serially and
+    in parallel), must give the same summary as condensing the whole file.
+    There should be no output if all of the assertions pass.
+    """
+    import filecmp
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        def path(name):
+            return os.path.join(tmp_dir, name)
+        raw_file, serial_file = _synthetic_summary(tmp_dir, city, n_rows)
+        with open(raw_file, 'rb') as f_in:
+            data = f_in.read()
+        # condense up to the middle of a line, then append the rest
+        cut = len(data) // 2
+        assert data[cut - 1:cut] != b'\n'
+        with open(path('growing.csv'), 'wb') as f_out:
+            f_out.write(data[:cut])
+        assert condense_data(path('growing.csv'), path('incremental.csv'), city,
+                             incremental=True) == 'full'
+        with open(path('growing.csv'), 'ab') as f_out:
+            f_out.write(data[cut:])
+        assert condense_data(path('growing.csv'), path('incremental.csv'), city,
+                             incremental=True) == 'append'
+        assert filecmp.cmp(serial_file, path('incremental.csv'), shallow=False)
+
+        # a last line without a newline that is never completed
+        with open(path('unterminated.csv'), 'wb') as f_out:
+            f_out.write(data[:-1])
+        assert condense_data(path('unterminated.csv'), path('unterminated-serial.csv'),
+                             city, incremental=True) == 'full'
+        condense_cities_parallel({city: {'in_file': path('unterminated.csv'),
+                                         'out_file': path('unterminated-parallel.csv')}},
+                                 processes, len(data) // 5, incremental=True)
+        assert condense_data(path('unterminated.csv'), path('unterminated-serial.csv'),
+                             city, incremental=True) == 'skip'
+        for name in ('unterminated-serial.csv', 'unterminated-parallel.csv'):
+            assert filecmp.cmp(serial_file, path(name), shallow=False), name
+
+def check_parallel_condense(city='NYC', n_rows=20000, processes=2):
+    """
+    This function checks that condense_cities_parallel, over several chunks,
+    writes a summary byte-identical to condense_data on n_rows synthetic
+    trips of a city, in a temporary directory. There should be no output if
+    the assertion passes.
+    """
+    import filecmp
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_file, serial_file = _synthetic_summary(tmp_dir, city, n_rows)
+        parallel_file = os.path.join(tmp_dir, 'parallel.csv')
+        condense_cities_parallel({city: {'in_file': raw_file, 'out_file': parallel_file}},
+                                 processes, os.path.getsize(raw_file) // 5)
+        assert filecmp.cmp(serial_file, parallel_file, shallow=False)
+
+def check_pipelined_condense(city='NYC', n_rows=20000):
+    """
+    This function checks that condense_data with pipeline set, over several
+    batches, writes a summary byte-identical to the serial one on n_rows
+    synthetic trips of a city, in a temporary directory, also when the city
+    schema was added with register_city_schema. There should be no output
+    if all of the assertions pass.
+    """
+    import filecmp
+    import tempfile
+    global PIPELINE_BATCH_ROWS
+    saved = PIPELINE_BATCH_ROWS
+    # the same layout under a name only this process knows
+    registered = city + '-registered'
+    register_city_schema(registered, **CITY_SCHEMAS[city])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            # several batches, so their order is checked too
+            PIPELINE_BATCH_ROWS = max(1, n_rows // 7)
+            raw_file, serial_file = _synthetic_summary(tmp_dir, city, n_rows)
+            for name in (city, registered):
+                pipelined_file = os.path.join(tmp_dir, name + '-pipelined.csv')
+                condense_data(raw_file, pipelined_file, name, pipeline=True)
+                assert filecmp.cmp(serial_file, pipelined_file, shallow=False), name
+        finally:
+            PIPELINE_BATCH_ROWS = saved
+            del CITY_SCHEMAS[registered]
+
+def check_analysis_backends(city='NYC', n_rows=20000):
+    """
+    This function checks that the numpy and python backends of
+    summarise_trips give exactly the same statistics, and duration_distribution
+    the same histograms and quantiles, on the summary of n_rows synthetic
+    trips of a city, in a temporary directory. There should be no output if
+    all of the assertions pass.
+    """
+    import tempfile
+    global analysis_backend
+    saved = analysis_backend
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            raw_file, serial_file = _synthetic_summary(tmp_dir, city, n_rows)
+            outputs = {}
+            for backend in ('python', 'numpy'):
+                analysis_backend = backend
+                _trip_stats_cache.clear()
+                stats = summarise_trips(serial_file)
+                histograms, sketches = duration_distribution(
+                    serial_file, DurationHistogram.linear(0, 75, 10))
+                outputs[backend] = (stats.trip_counts(), stats.duration_summary(),
+                                    stats.rush_hour_counts(), stats.user_minutes,
+                                    {user_type: histogram.counts
+                                     for user_type, histogram in histograms.items()},
+                                    {user_type: sketch.quantile(0.5)
+                                     for user_type, sketch in sketches.items()})
+            assert outputs['python'] == outputs['numpy']
+        finally:
+            analysis_backend = saved
+            _trip_stats_cache.clear()
+
+def check_result_cache(city='NYC', n_rows=20000):
+    """
+    This function checks that rewriting a summary invalidates its cached
+    results, on n_rows synthetic trips of a city in a temporary directory
+    with a temporary result cache. The summary is condensed again with the
+    user types of the longest subscriber and shortest customer trips
+    swapped, so it keeps its size, and given back its mtime, so only
+    invalidate_results can tell the files apart. There should be no output if all of the assertions pass.
+    """
+    import tempfile
+    global result_cache_file
+    saved = result_cache_file
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            result_cache_file = os.path.join(tmp_dir, 'results.sqlite')
+            raw_file, serial_file = _synthetic_summary(tmp_dir, city, n_rows)
+            before = usertype_average(serial_file)
+
+            # swap the user types of the longest subscriber and the shortest
+            # customer trips, enough of them to move the rounded averages
+            with open(raw_file, newline='') as f_in:
+                rows = list(csv.reader(f_in))
+            header = rows[0]
+            extract = compile_row_extractor(header, city)
+            column = header.index(CITY_SCHEMAS[city]['user_type'])
+            trips = {'Subscriber': [], 'Customer': []}
+            for i, row in enumerate(rows[1:], 1):
+                duration, month, hour, day_of_week, user_type = extract(row)
+                trips.setdefault(user_type, []).append((duration, i))
+            longest = sorted(trips['Subscriber'], reverse=True)
+            shortest = sorted(trips['Customer'])
+            for (_, i), (_, j) in islice(zip(longest, shortest), max(1, n_rows // 10)):
+                rows[i][column], rows[j][column] = rows[j][column], rows[i][column]
+            swapped_file = os.path.join(tmp_dir, 'swapped.csv')
+            with open(swapped_file, 'w', newline='') as f_out:
+                csv.writer(f_out).writerows(rows)
+
+            file_stat = os.stat(serial_file)
+            condense_data(swapped_file, serial_file, city)
+            os.utime(serial_file, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+            assert os.path.getsize(serial_file) == file_stat.st_size
+            after = usertype_average(serial_file)
+            # a new run, with nothing remembered in this process
+            _result_memo.clear()
+            _trip_stats_cache.clear()
+            assert usertype_average(serial_file) == after
+            stats = summarise_trips(serial_file)
+            assert after == (stats.average_duration('Subscriber'),
+                             stats.average_duration('Customer'))
+            assert after != before
+        finally:
+            invalidate_results(serial_file)
+            result_cache_file = saved
+
+# Checks run by the check command, each called with a city and a number of
+# synthetic trips
+CONDENSE_CHECKS = [check_incremental_condense, check_parallel_condense,
+                   check_pipelined_condense, check_analysis_backends,
+                   check_result_cache]
+
+def summary_files(city_info):
+    """
+    Returns the summary file of each city in city_info.
+    """
+    return {city: filenames['out_file'] for city, filenames in city_info.items()}
+
+def condense_cities(city_info, processes=None, incremental=True, columnar=False,
+                    partitioned=False, stations=False):
+    """
+    This function condenses every city in city_info in parallel and prints the
+    first data point of each summary. Inputs that have not changed since the
+    last run are skipped and rows appended to them are added to the existing
+    summaries unless incremental is False. With columnar set the columnar
+    summaries are written alongside and their footprint compared. With
+    partitioned set each summary is also partitioned (see partition_summary)
+    unless its partitions are newer than it. With stations set a summary
+    with stations and its origin-destination matrix are written alongside
+    (see station_files_of).
+    """
+    condense_cities_parallel(city_info, processes, incremental=incremental)
+    for city, filenames in city_info.items():
+        print_first_point(filenames['out_file'])
+    if partitioned:
+        for city, filenames in city_info.items():
+            index = os.path.join(partition_dir_of(filenames['out_file']), PARTITION_INDEX)
+            if (not incremental or not os.path.exists(index)
+                    or os.path.getmtime(index) < os.path.getmtime(filenames['out_file'])):
+                partition_summary(filenames['out_file'])
+    if columnar:
+        for city, filenames in city_info.items():
+            columnar_file = filenames['out_file'].replace('.csv', '.col')
+            condense_data(filenames['in_file'], columnar_file, city, columnar=True)
+            print('{}: csv summary {:,} bytes, columnar summary {:,} bytes'.format(
+                city, os.path.getsize(filenames['out_file']), os.path.getsize(columnar_file)))
+    if stations:
+        for city, filenames in city_info.items():
+            station_file, od_file = station_files_of(filenames['out_file'])
+            condense_data(filenames['in_file'], station_file, city, stations=True,
+                          od_file=od_file)
+
+def print_station_flows(city_info, n=10, user_type=None):
+    """
+    This function prints the n busiest station pairs of every city in
+    city_info in the morning and evening rush hours, and the stations that
+    gain and lose the most bikes in each, from the origin-destination
+    matrices written by condense --stations.
+    """
+    for city, filenames in city_info.items():
+        od = ODMatrix.load(station_files_of(filenames['out_file'])[1])
+        for hour_band in ('am_rush', 'pm_rush'):
+            print('{} {}: busiest flows'.format(city, hour_band))
+            for origin, destination, count, minutes in od.top_flows(n, user_type, hour_band):
+                print('  {} -> {}: {:,} trips averaging {:.1f} minutes'.format(
+                    origin, destination, count, minutes))
+            print('{} {}: largest imbalance'.format(city, hour_band))
+            for station, departures, arrivals, net in od.station_imbalance(
+                    hour_band, user_type, n):
+                print('  {}: {:,} departures, {:,} arrivals, net {:+,}'.format(
+                    station, departures, arrivals, net))
+
+def print_partition_query(city_info, **filters):
+    """
+    This function answers a query (see PartitionedSummary) from the
+    partitioned summary of every city in city_info and prints the number of
+    trips, their average duration and the share of the summary read.
+    """
+    for city, filenames in city_info.items():
+        summary = PartitionedSummary(partition_dir_of(filenames['out_file']))
+        profile = RunProfile()
+        count, minutes = summary.query(profile, **filters)
+        total_bytes = sum(partition['groups'][-1]['offset'] + partition['groups'][-1]['length']
+                          for partition in summary.partitions if partition['groups'])
+        print('{}: {:,} trips averaging {:.1f} minutes, {:.1%} of the summary read'.format(
+            city, count, minutes / count if count else 0.0,
+            profile.counters.get('bytes_read', 0) / total_bytes if total_bytes else 0.0))
+
+def print_cube_summary(city_info):
+    """
+    This function combines the aggregate cubes written while condensing and
+    prints the weekday rush hour subscriber trips of each city.
+    """
+    trip_cube = TripCube()
+    for city, filenames in city_info.items():
+        trip_cube.merge(TripCube.load(filenames['cube_file']))
+    for city in trip_cube.cities:
+        count, minutes = trip_cube.query(city=city, hour=RUSH_HOURS,
+                                         day_of_week=WEEKDAYS, user_type='Subscriber')
+        if count == 0:
+            print('{}: no subscriber trips in weekday rush hours'.format(city))
+            continue
+        print('{}: {:,} subscriber trips in weekday rush hours, averaging {:.1f} minutes'.format(
+            city, count, minutes / count))
+
+def print_trip_statistics(city_file):
+    """
+    This function prints which city has the most trips and the highest
+    proportions of subscribers and customers, then the average trip duration
+    and average duration by user type of each city.
+    """
+    Total = {}
+    Subscriber_proportion = {}
+    Customer_proportion = {}
+    for city, filenames in city_file.items():
+        Total[city] = number_of_trips(filenames)[2]
+        Subscriber_proportion[city] = ((number_of_trips(filenames)[0] / number_of_trips(filenames)[2]) * 100)
+        Customer_proportion[city] = ((number_of_trips(filenames)[1] / number_of_trips(filenames)[2]) * 100)
+    max_total = max(Total, key=Total.get)
+    print('City with most trips:', max_total)
+    max_subscriber_proportion = max(Subscriber_proportion, key=Subscriber_proportion.get)
+    print('City with highest proportion of subscribers:', max_subscriber_proportion)
+    max_customer_proportion = max(Customer_proportion, key=Customer_proportion.get)
+    print('City with highest proportion of customers:', max_customer_proportion)
+    for city, filename in city_file.items():
+        print('{} has an average trip duration of {} minutes with {} % of rides over 30 minutes'.format(city, duration_of_trips(filename)[0], duration_of_trips(filename)[1]))
+    for city, filename in city_file.items():
+        print('{} : Subscribers have an average trip duration of {} minutes, Customers have an average trip duration of {} minutes '.format(city, usertype_average(filename)[0], usertype_average(filename)[1]))
+
+def _print_progress(rows, seconds, rows_per_sec):
+    """
+    RunProfile progress callback printing to stderr.
+    """
+    print('{:,} rows in {:.1f}s ({:,.0f} rows/s)'.format(rows, seconds, rows_per_sec),
+          file=sys.stderr)
+
+def profile_condense(city_info, incremental=True):
+    """
+    This function condenses every city in city_info one after the other
+    with a RunProfile, printing progress to stderr, and returns the profile
+    of each city as a dictionary.
+    """
+    profiles = {}
+    for city, filenames in city_info.items():
+        profile = RunProfile(progress=_print_progress)
+        condense_data(filenames['in_file'], filenames['out_file'], city,
+                      cube_file=filenames.get('cube_file'),
+                      incremental=incremental, profile=profile)
+        profiles[city] = profile.to_dict()
+    return profiles
+
+def profile_statistics(city_file):
+    """
+    This function runs number_of_trips, duration_of_trips and
+    usertype_average on the summary file of every city with a RunProfile and
+    returns the profile of each city as a dictionary.
+    """
+    profiles = {}
+    for city, filename in city_file.items():
+        profile = RunProfile()
+        number_of_trips(filename, profile)
+        duration_of_trips(filename, profile)
+        usertype_average(filename, profile)
+        profiles[city] = profile.to_dict()
+    return profiles
+
+def plot_report(city_file):
+    """
+    This function draws the charts of the analysis: the example histogram,
+    the trip duration histograms for Washington and the rush hour chart for
+    NYC (for whichever of these cities are in city_file). When figure_dir is
+    set the charts are rendered headless in parallel by render_charts.
+    """
+    if figure_dir is None:
+        plot_example_histogram()
+        if 'Washington' in city_file:
+            plot_all_durations(city_file['Washington'])
+            plot_all(city_file['Washington'])
+        if 'NYC' in city_file:
+            plot_analysis(city_file['NYC'])
+        return
+    charts = [example_chart()]
+    if 'Washington' in city_file:
+        charts.extend(duration_charts(city_file['Washington']))
+    if 'NYC' in city_file:
+        charts.append(rush_hour_chart(city_file['NYC']))
+    render_charts(charts)
+    _print_quantiles(charts)
+    if 'NYC' in city_file:
+        print_rush_hour_percentages(city_file['NYC'])
+
+def plot_city_charts(city_file, processes=None):
+    """
+    This function renders every chart of every city in city_file headless
+    (see render_charts) and prints how many were drawn and how many were
+    unchanged.
+    """
+    drawn, copied = render_charts([example_chart()] + city_charts(city_file),
+                                  processes=processes)
+    print('{} charts drawn, {} unchanged charts copied from the cache'.format(drawn, copied))
+
+def run_benchmarks(city_info):
+    """
+    This function compares the start time parsers on each raw city file and
+    the analysis backends on each summary file.
+    """
+    for city, filenames in city_info.items():
+        benchmark_time_of_trip(filenames['in_file'], city)
+    for city, filenames in city_info.items():
+        benchmark_analysis_backends(filenames['out_file'])
+
+def run_report(city_info=city_info):
+    """
+    This function runs the whole analysis, as the notebook does: checks the
+    parsers, condenses the data, prints the statistics and draws the charts.
+    """
+    check_city_parsers([city_info[city]['in_file'] for city in ('NYC', 'Chicago', 'Washington')
+                        if city in city_info])
+    condense_cities(city_info)
+    print_cube_summary(city_info)
+    print_trip_statistics(summary_files(city_info))
+    plot_report(summary_files(city_info))
+
+def city_files(data_dir):
+    """
+    Returns city_info with every file moved to data_dir. A raw input file
+    that only exists compressed (e.g. NYC-CitiBike-2016.csv.gz) is read from
+    there.
+    """
+    cities = {city: {kind: os.path.join(data_dir, os.path.basename(path))
+                     for kind, path in filenames.items()}
+              for city, filenames in city_info.items()}
+    for filenames in cities.values():
+        if not os.path.exists(filenames['in_file']):
+            for suffix in COMPRESSED_SUFFIXES:
+                if os.path.exists(filenames['in_file'] + suffix):
+                    filenames['in_file'] += suffix
+                    break
+    return cities
+
+def main(argv=None):
+    """
+    Command line interface. Runs the whole report when no command is given:
+
+        python Bike_Share_Analysis.py [--data-dir DIR] [--city CITY ...]
+            [--output-dir DIR] [--no-cache]
+            [condense [--processes N] [--full] [--columnar] [--profile]
+                      [--partitioned] [--stations]
+             | stats [--backend python|numpy] [--profile]
+             | plot [--all] [--processes N]
+             | query [--month M] [--hour H] [--hours H-H] [--day DAY]
+                     [--user-type TYPE]
+             | flows [--top N] [--user-type TYPE]
+             | live (--follow FILE | --listen HOST:PORT|PATH) [--interval S]
+                    [--from-start] [--event-time]
+             | generate [--rows N] [--seed SEED]
+             | check [--rows N]
+             | bench [--micro] [--baseline FILE] [--save-baseline]
+                     [--tolerance T]]
+    """
+    import argparse
+    global analysis_backend, figure_dir, result_cache_file, figure_cache_dir
+    # options shared by every command, accepted before or after it
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--data-dir', default=argparse.SUPPRESS,
+                        help='directory of the raw and summary files (default: ./data)')
+    common.add_argument('--city', action='append', choices=sorted(city_info),
+                        default=argparse.SUPPRESS,
+                        help='only process this city (repeatable)')
+    common.add_argument('--output-dir', default=argparse.SUPPRESS,
+                        help='directory the charts are saved in (default: ./figures)')
+    common.add_argument('--no-cache', action='store_true', default=argparse.SUPPRESS,
+                        help='do not use the persistent result and chart caches')
+    parser = argparse.ArgumentParser(description='2016 US bike share analysis',
+                                     parents=[common])
+    commands = parser.add_subparsers(dest='command')
+    condense = commands.add_parser('condense', parents=[common],
+                                   help='condense the raw trip files')
+    condense.add_argument('--processes', type=int, default=None,
+                          help='worker processes (default: all cores)')
+    condense.add_argument('--full', action='store_true',
+                          help='rebuild every summary instead of updating it')
+    condense.add_argument('--columnar', action='store_true',
+                          help='also write columnar summaries')
+    condense.add_argument('--profile', action='store_true',
+                          help='condense one city at a time and print per-stage timings as json')
+    condense.add_argument('--partitioned', action='store_true',
+                          help='also write summaries partitioned by month and user type')
+    condense.add_argument('--stations', action='store_true',
+                          help='also write summaries with stations and origin-destination matrices')
+    stats = commands.add_parser('stats', parents=[common],
+                                help='print the trip statistics')
+    stats.add_argument('--backend', choices=('python', 'numpy'),
+                       default=analysis_backend)
+    stats.add_argument('--profile', action='store_true',
+                       help='print timings and cache counters as json instead')
+    plot = commands.add_parser('plot', parents=[common],
+                               help='save the charts as png files')
+    plot.add_argument('--all', action='store_true',
+                      help='draw every chart of every city, not just those of the report')
+    plot.add_argument('--processes', type=int, default=None,
+                      help='rendering processes (default: all cores)')
+    query = commands.add_parser('query', parents=[common],
+                                help='count trips in the partitioned summaries')
+    query.add_argument('--month', type=int, action='append')
+    query.add_argument('--hour', type=int, action='append')
+    query.add_argument('--hours', help='hour range, e.g. 7-9')
+    query.add_argument('--day', action='append', choices=list(calendar.day_name),
+                       dest='day_of_week')
+    query.add_argument('--user-type', action='append')
+    flows = commands.add_parser('flows', parents=[common],
+                                help='print the busiest station pairs and imbalances in rush hours')
+    flows.add_argument('--top', type=int, default=10)
+    flows.add_argument('--user-type', action='append')
+    live = commands.add_parser('live', parents=[common],
+                               help='print rolling statistics of a live trip feed of one --city')
+    source = live.add_mutually_exclusive_group(required=True)
+    source.add_argument('--follow', help='raw trip file to follow as rows are appended')
+    source.add_argument('--listen', help='HOST:PORT or unix socket path to receive rows on')
+    live.add_argument('--interval', type=float, default=10.0,
+                      help='seconds between snapshots (default: 10)')
+    live.add_argument('--from-start', action='store_true',
+                      help='also count the rows already in the followed file')
+    live.add_argument('--event-time', action='store_true',
+                      help='end the windows at the latest trip instead of now, for replays')
+    generate = commands.add_parser('generate', parents=[common],
+                                   help='write synthetic raw trip files')
+    generate.add_argument('--rows', type=int, default=1000000,
+                          help='trips per city (default: 1,000,000)')
+    generate.add_argument('--seed', type=int, default=2016)
+    check = commands.add_parser('check', parents=[common],
+                                help='run the condense and analysis checks on synthetic trips')
+    check.add_argument('--rows', type=int, default=20000,
+                       help='synthetic trips per city (default: 20,000)')
+    bench = commands.add_parser('bench', parents=[common],
+                                help='time condensing and the analysis against a baseline')
+    bench.add_argument('--micro', action='store_true',
+                       help='only compare the start time parsers and analysis backends')
+    bench.add_argument('--baseline', default=BENCHMARK_BASELINE,
+                       help='baseline results file (default: {})'.format(BENCHMARK_BASELINE))
+    bench.add_argument('--save-baseline', action='store_true',
+                       help='store these results as the new baseline')
+    bench.add_argument('--tolerance', type=float, default=BENCHMARK_TOLERANCE,
+                       help='allowed fractional slowdown before failing')
+    args = parser.parse_args(argv)
+    if getattr(args, 'no_cache', False):
+        result_cache_file = None
+        figure_cache_dir = None
+    cities = city_files(getattr(args, 'data_dir', './data'))
+    if getattr(args, 'city', None):
+        cities = {city: cities[city] for city in args.city}
+    output_dir = getattr(args, 'output_dir', './figures')
+    if args.command == 'condense' and args.profile:
+        print(json.dumps(profile_condense(cities, not args.full), indent=2))
+    elif args.command == 'condense':
+        condense_cities(cities, args.processes, not args.full, args.columnar,
+                        args.partitioned, args.stations)
+    elif args.command == 'flows':
+        print_station_flows(cities, args.top, args.user_type)
+    elif args.command == 'query':
+        hours = args.hour
+        if args.hours:
+            first, last = args.hours.split('-')
+            hours = (hours or []) + list(range(int(first), int(last) + 1))
+        print_partition_query(cities, month=args.month, hour=hours,
+                              day_of_week=args.day_of_week, user_type=args.user_type)
+    elif args.command == 'stats' and args.profile:
+        analysis_backend = args.backend
+        print(json.dumps(profile_statistics(summary_files(cities)), indent=2))
+    elif args.command == 'stats':
+        analysis_backend = args.backend
+        print_trip_statistics(summary_files(cities))
+        if 'NYC' in cities:
+            print_rush_hour_percentages(cities['NYC']['out_file'])
+    elif args.command == 'plot' and args.all:
+        figure_dir = output_dir
+        plot_city_charts(summary_files(cities), args.processes)
+    elif args.command == 'plot':
+        figure_dir = output_dir
+        plot_report(summary_files(cities))
+    elif args.command == 'live':
+        if len(getattr(args, 'city', None) or []) != 1:
+            parser.error('live needs exactly one --city')
+        listen = args.listen
+        if listen and ':' in listen and os.path.sep not in listen:
+            host, port = listen.rsplit(':', 1)
+            listen = (host, int(port))
+        run_live(args.city[0], args.follow, listen, args.interval, args.from_start,
+                 wall_clock=not args.event_time)
+    elif args.command == 'generate':
+        generate_city_files(cities, args.rows, args.seed)
+    elif args.command == 'check':
+        for city in cities:
+            for check in CONDENSE_CHECKS:
+                check(city, args.rows)
+                print('{}: {} passed'.format(city, check.__name__))
+    elif args.command == 'bench':
+        if args.micro:
+            run_benchmarks(cities)
+            return 0
+        results = benchmark_suite(cities)
+        print_benchmark_results(results)
+        if args.save_baseline:
+            save_benchmark_baseline(results, args.baseline)
+        elif os.path.exists(args.baseline):
+            regressions = benchmark_regressions(results, args.baseline, args.tolerance)
+            for regression in regressions:
+                print('REGRESSION ' + regression, file=sys.stderr)
+            if regressions:
+                return 1
+        else:
+            print('no baseline at {}, run with --save-baseline to store one'.format(
+                args.baseline), file=sys.stderr)
+    else:
+        figure_dir = output_dir
+        run_report(cities)
+    return 0
 
-city_file = {'NYC':('./data/NYC-2016-Summary.csv')}
-        
-for city, filename in city_file.items():
-    plot_analysis(filename)
+if __name__ == '__main__':
+    sys.exit(main())
 
 #from subprocess import call
 #call(['python', '-m', 'nbconvert', 'Bike_Share_Analysis.ipynb'])